@@ -1,37 +1,27 @@
+import asyncio
+import json
 import logging
 import os
+import queue
+import random
 import socket
-import subprocess
 import sys
 import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturoTimeoutError
 from datetime import datetime
-import runpy
-import main
-if False:
-    import main
-if True:
-    import main
-import psutil
+
 import pytz
 import requests
-from flask import Flask, jsonify
+import websockets
+from requests.adapters import HTTPAdapter
+from flask import Flask, jsonify, request
+from waitress import serve
+from dotenv import load_dotenv
 
 from logging_config import LoggingConfigurator  # Configuração de logging personalizada
 
-# ----------------------------------------------------------------------
-# Se o script for chamado com o argumento "main.py", executa o main.py
-# e encerra para evitar que o agente se reinicie.
-#
-# Usamos os.path.basename para comparar apenas o nome do arquivo,
-# assim, mesmo que o caminho completo seja passado (por exemplo, em modo empacotado),
-# a verificação funcionará corretamente.
-# ----------------------------------------------------------------------
-if len(sys.argv) > 1 and os.path.basename(sys.argv[1]) == "main.py":
-    # Executa o main.py utilizando runpy e encerra o processo
-    runpy.run_path(sys.argv[1], run_name="__main__")
-    sys.exit(0)
-
 # ----------------------------------------------------------------------
 # Configuração de logging para o agente
 # ----------------------------------------------------------------------
@@ -46,41 +36,102 @@ load_dotenv(dotenv_path="config/config.env")
 # Identificação e endereço do servidor
 ID_MAQUINA = os.getenv("ID_MAQUINA")
 URL_SERVIDOR = os.getenv("URL_SERVIDOR")
+# Canal WebSocket para receber comandos; por padrão deriva do URL_SERVIDOR (http -> ws, https -> wss)
+WS_SERVIDOR = os.getenv("WS_SERVIDOR") or (URL_SERVIDOR or "").replace("http", "ws", 1)
+
+# Timeouts (conexão, leitura) das requisições ao servidor
+TIMEOUT_HTTP = (2, 5)
+# Executor de uma única thread para o polling: limita a uma requisição em voo e
+# permite deixar de esperar uma leitura travada sem bloquear o loop de verificação
+# (o timeout em si fica na requisição; a espera pelo resultado só cobre leituras lentas
+# que, recebendo dados aos poucos, nunca estouram o timeout de leitura)
+EXECUTOR_POLLING = ThreadPoolExecutor(max_workers=1, thread_name_prefix="polling")
+
+# Sessão HTTP compartilhada: mantém conexões keep-alive com o servidor em vez de
+# abrir um novo TCP/TLS a cada requisição (as novas tentativas ficam a cargo de requisicao_servidor)
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+SESSION.headers.update({"Connection": "keep-alive"})
+
+# Fuso horário utilizado nos registros de início/fim (resolvido uma única vez)
+TIMEZONE = pytz.timezone("America/Sao_Paulo")
 
 # Estado do sistema controlado pelo agente
-status_sistema = {"status": "parado", "id": ID_MAQUINA}
+status_sistema = {"status": "parado", "id": ID_MAQUINA, "max_lag": 0.0}
 sistema_executando = False
-processo_sistema = None
+thread_sistema = None
+evento_parada = None
+# Arquivo de lock que impede instâncias duplicadas do agente (mantido aberto enquanto o processo viver)
+arquivo_lock = None
+# Fila de tamanho 1 usada como "dirty flag": sinaliza que há status pendente de envio
+fila_status = queue.Queue(maxsize=1)
+# Versão do status, incrementada a cada mudança; usada como ETag do endpoint /status
+versao_status = 0
+# Início recebido via WebSocket enquanto a execução anterior ainda finalizava (status "parando");
+# monitorar_sistema o executa quando a thread termina. Um comando posterior o substitui
+comando_pendente = None
+lock_comando_pendente = threading.Lock()
+# Identificador desta inicialização do agente, prefixado à versão no ETag: após um reinício a
+# versão volta a 0, e sem ele um cliente com o ETag antigo receberia 304 para um status diferente
+id_inicializacao = uuid.uuid4().hex
+
+
+def atualizar_status(novo_status):
+    """Atualiza o status do sistema, incrementando a versão (ETag) somente quando ele muda."""
+    global versao_status
+    if status_sistema["status"] != novo_status:
+        status_sistema["status"] = novo_status
+        versao_status += 1
 
 
 def obter_horario_local():
     """Retorna o horário local para 'America/Sao_Paulo'."""
-    timezone = pytz.timezone("America/Sao_Paulo")
-    return datetime.now(timezone)
+    return datetime.now(TIMEZONE)
+
+
+def requisicao_servidor(metodo, url, tentativas=4, atraso_base=1.0, **kwargs):
+    """
+    Executa uma requisição HTTP ao servidor com backoff exponencial e jitter.
+    Repete em caso de falha de conexão/timeout ou resposta 5xx, para que vários agentes
+    reiniciados ao mesmo tempo não sobrecarreguem o servidor em sincronia.
+    """
+    for tentativa in range(tentativas):
+        try:
+            resposta = SESSION.request(metodo, url, **kwargs)
+            if resposta.status_code < 500 or tentativa == tentativas - 1:
+                return resposta
+            logging.warning(f"Servidor respondeu {resposta.status_code} para {url}. Tentativa {tentativa + 1}/{tentativas}.")
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if tentativa == tentativas - 1:
+                raise
+            logging.warning(f"Falha de conexão com {url}: {e}. Tentativa {tentativa + 1}/{tentativas}.")
+        time.sleep(min(30, atraso_base * 2 ** tentativa) + random.uniform(0, atraso_base))
 
 
-def processo_esta_rodando(pid):
-    """Verifica se um processo está em execução pelo PID."""
+def enviar_status():
+    """
+    Agenda o envio do status da máquina ao servidor, sem bloquear o chamador.
+    Chamadas repetidas antes do envio são agrupadas em uma única requisição com o status mais recente.
+    """
     try:
-        processo = psutil.Process(pid)
-        return processo.is_running()
-    except psutil.NoSuchProcess:
-        return False
+        fila_status.put_nowait(True)
+    except queue.Full:
+        pass  # Já existe um envio pendente, que lerá o status atual
 
 
-def exibir_logs_processo(processo):
-    """Captura a saída do processo e exibe no terminal."""
-    for linha in iter(processo.stdout.readline, ''):
-        sys.stdout.write(linha)
-        sys.stdout.flush()
-    processo.stdout.close()
+def processar_envios_status():
+    """Thread que envia ao servidor o status atual sempre que houver uma alteração pendente."""
+    while True:
+        fila_status.get()
+        transmitir_status()
 
 
-def enviar_status():
+def transmitir_status():
     """Envia o status da máquina ao servidor."""
     try:
         dados = {"id": ID_MAQUINA, "status": status_sistema["status"]}
-        resposta = requests.post(f"{URL_SERVIDOR}/status", json=dados, timeout=5)
+        resposta = requisicao_servidor("POST", f"{URL_SERVIDOR}/status", json=dados, timeout=TIMEOUT_HTTP)
         if resposta.status_code == 200:
             logging.info(f"Status atualizado no servidor: {status_sistema['status']}")
         else:
@@ -93,15 +144,15 @@ def registrar_status():
     """Verifica se a máquina deve estar rodando e ajusta o estado inicial."""
     global sistema_executando
     try:
-        resposta = requests.get(f"{URL_SERVIDOR}/machines", timeout=5)
+        resposta = requisicao_servidor("GET", f"{URL_SERVIDOR}/machines", timeout=TIMEOUT_HTTP)
         if resposta.status_code == 200:
             maquinas = resposta.json()
             if ID_MAQUINA in maquinas and maquinas[ID_MAQUINA]["status"] == "rodando":
                 sistema_executando = True
-                status_sistema["status"] = "rodando"
+                atualizar_status("rodando")
             else:
                 sistema_executando = False
-                status_sistema["status"] = "parado"
+                atualizar_status("parado")
     except Exception as e:
         logging.error(f"Erro ao registrar status: {e}")
     enviar_status()
@@ -109,171 +160,336 @@ def registrar_status():
 
 @app.route("/status", methods=["GET"])
 def obter_status():
-    """Endpoint que retorna o status atual do agente."""
-    return jsonify(status_sistema)
+    """
+    Endpoint que retorna o status atual do agente.
+    Responde 304 (sem corpo) quando o cliente já possui a versão atual (If-None-Match).
+    """
+    etag = f'"{id_inicializacao}-{versao_status}"'
+    if request.headers.get("If-None-Match") == etag:
+        return "", 304, {"ETag": etag}
+    resposta = jsonify(status_sistema)
+    resposta.headers["ETag"] = etag
+    return resposta
 
 
 @app.route("/start", methods=["POST"])
 def iniciar_sistema():
+    """Endpoint para iniciar o sistema principal."""
+    resposta, codigo = executar_inicio()
+    return jsonify(resposta), codigo
+
+
+@app.route("/stop", methods=["POST"])
+def parar_sistema():
+    """Endpoint para parar o sistema principal e atualizar o status."""
+    resposta, codigo = executar_parada()
+    return jsonify(resposta), codigo
+
+
+def executar_inicio():
     """
-    Endpoint para iniciar o sistema principal.
-    Ao receber o comando, inicia o main.py em um subprocesso.
+    Inicia o sistema principal (main.run) em uma thread do próprio agente,
+    evitando o custo de subir um novo interpretador Python.
+    Retorna a mensagem de resposta e o código HTTP correspondente.
     """
-    global sistema_executando, processo_sistema
+    global sistema_executando, thread_sistema, evento_parada
+    # Enquanto a execução anterior não terminar (inclusive durante uma parada), não inicia outra:
+    # duas execuções simultâneas disputariam o diretório temp
+    if thread_sistema and thread_sistema.is_alive():
+        if evento_parada is not None and evento_parada.is_set():
+            return {"message": "Sistema ainda finalizando a execução anterior."}, 400
+        return {"message": "Sistema já rodando."}, 400
     if sistema_executando:
-        if processo_sistema and processo_esta_rodando(processo_sistema.pid):
-            return jsonify({"message": "Sistema já rodando."}), 400
-        else:
-            logging.warning("Processo foi finalizado inesperadamente. Reiniciando...")
-            sistema_executando = False
-            processo_sistema = None
+        logging.warning("Processo foi finalizado inesperadamente. Reiniciando...")
+        sistema_executando = False
+        thread_sistema = None
 
     inicio = obter_horario_local()
     logging.info(f"Comando de INÍCIO recebido. Iniciado às: {inicio.strftime('%d/%m/%Y %H:%M:%S')}")
 
     sistema_executando = True
-    status_sistema["status"] = "rodando"
+    atualizar_status("rodando")
     enviar_status()
 
     try:
-        # Define o caminho para o main.py
-        # Em modo empacotado, main.py deve ter sido incluído via --add-data "main.py;."
-        if getattr(sys, 'frozen', False):
-            caminho_main = os.path.join(sys._MEIPASS, "main.py")
-        else:
-            caminho_main = "main.py"
-
-        # Define o comando para executar main.py.
-        # Ao passar "main.py" como argumento, o bloco inicial deste script detecta e executa main.py.
-        comando = [sys.executable, caminho_main]
-
-        # Inicia o subprocesso que executa main.py
-        processo_sistema = subprocess.Popen(
-            comando,
-            stdout=sys.stdout,
-            stderr=sys.stderr,
-            universal_newlines=True
-        )
-        logging.info(f"Sistema iniciado com PID {processo_sistema.pid}.")
-        threading.Thread(target=monitorar_sistema, args=(inicio,), daemon=True).start()
+        # Importado sob demanda: o agente só carrega a pilha do extrator (pandas, pyodbc...) quando necessário
+        import main
+        evento_parada = threading.Event()
+        thread_sistema = threading.Thread(target=main.run, args=(evento_parada,), name="sistema-principal", daemon=True)
+        thread_sistema.start()
+        logging.info(f"Sistema iniciado na thread '{thread_sistema.name}'.")
+        threading.Thread(target=monitorar_sistema, args=(inicio, thread_sistema), daemon=True).start()
     except Exception as e:
         logging.error(f"Erro ao iniciar sistema: {e}")
         sistema_executando = False
-        status_sistema["status"] = "parado"
+        atualizar_status("parado")
         enviar_status()
-        return jsonify({"message": "Falha ao iniciar."}), 500
+        return {"message": "Falha ao iniciar."}, 500
 
-    return jsonify({"message": f"Sistema iniciado na máquina {ID_MAQUINA}."})
+    return {"message": f"Sistema iniciado na máquina {ID_MAQUINA}."}, 200
 
 
-@app.route("/stop", methods=["POST"])
-def parar_sistema():
-    """Endpoint para parar o sistema principal e atualizar o status."""
-    global sistema_executando, processo_sistema
+def executar_parada():
+    """
+    Sinaliza a parada do sistema principal e atualiza o status.
+    A execução é interrompida no próximo ponto de verificação de main.run; se ela não terminar
+    em 10 s, o status fica "parando" até a thread encerrar (ver monitorar_sistema).
+    Retorna a mensagem de resposta e o código HTTP correspondente.
+    """
+    global sistema_executando, thread_sistema
     if not sistema_executando:
-        return jsonify({"message": "Sistema já parado."}), 400
+        return {"message": "Sistema já parado."}, 400
 
     logging.info("Comando de PARADA recebido.")
 
-    if processo_sistema:
+    if thread_sistema:
         try:
-            processo_sistema.terminate()
-            processo_sistema.wait(timeout=10)
-            logging.info("Sistema principal parado com sucesso.")
+            evento_parada.set()
+            atualizar_status("parando")
+            enviar_status()
+            thread_sistema.join(timeout=10)
         except Exception as e:
             logging.error(f"Erro ao parar o sistema: {e}")
-            return jsonify({"message": "Erro ao parar o sistema."}), 500
-        finally:
-            processo_sistema = None
+            return {"message": "Erro ao parar o sistema."}, 500
+        if thread_sistema.is_alive():
+            # A thread continua referenciada: monitorar_sistema conclui a parada quando ela terminar
+            logging.warning("Sistema principal ainda finalizando a etapa atual; será interrompido no próximo ponto de verificação.")
+            return {"message": f"Parada solicitada na máquina {ID_MAQUINA}; aguardando a etapa atual."}, 202
+        logging.info("Sistema principal parado com sucesso.")
+        thread_sistema = None
 
     sistema_executando = False
-    status_sistema["status"] = "parado"
+    atualizar_status("parado")
     enviar_status()
 
     fim = obter_horario_local()
     logging.info(f"Finalizado às: {fim.strftime('%d/%m/%Y %H:%M:%S')}")
 
-    return jsonify({"message": f"Sistema parado na máquina {ID_MAQUINA}."})
+    return {"message": f"Sistema parado na máquina {ID_MAQUINA}."}, 200
 
 
-def monitorar_sistema(inicio):
+def monitorar_sistema(inicio, thread):
     """
-    Monitora o subprocesso que executa o sistema principal.
-    Quando o subprocesso termina, atualiza o status e registra o horário de finalização.
+    Monitora a thread que executa o sistema principal.
+    Quando ela termina, atualiza o status e registra o horário de finalização.
     """
-    global sistema_executando, processo_sistema
-    if processo_sistema:
-        processo_sistema.wait()
-        fim = obter_horario_local()
-        logging.info(f"Sistema finalizado com código {processo_sistema.returncode}.")
+    global sistema_executando, thread_sistema, comando_pendente
+    thread.join()
+    # Se uma parada (ou novo início) já tratou esta execução, não há o que atualizar
+    if thread_sistema is not thread:
+        return
+    fim = obter_horario_local()
+    logging.info(f"Sistema finalizado às {fim.strftime('%d/%m/%Y %H:%M:%S')}.")
 
-        sistema_executando = False
-        status_sistema["status"] = "parado"
-        enviar_status()
-        processo_sistema = None
+    sistema_executando = False
+    atualizar_status("parado")
+    enviar_status()
+    thread_sistema = None
+
+    with lock_comando_pendente:
+        comando, comando_pendente = comando_pendente, None
+    if comando:
+        logging.info(f"Executando o comando pendente '{comando}'.")
+        processar_comando(comando)
+
+
+def processar_comando(comando, guardar_pendente=False):
+    """
+    Executa localmente o comando recebido do servidor ("start" ou "stop"),
+    ignorando-o se o status atual já corresponder à ação.
+
+    Args:
+        guardar_pendente (bool): Se True, um início recusado fica em comando_pendente e é
+            executado quando a execução anterior terminar (canal WebSocket, em que o servidor
+            não guarda o comando).
+
+    Returns:
+        bool: False se o comando não pôde ser executado agora e deve continuar pendente
+        (início enquanto a execução anterior ainda finaliza); True caso contrário.
+    """
+    global comando_pendente
+    # Verificação e registro sob o lock: se a thread terminar logo depois, monitorar_sistema
+    # ainda encontra o pendente (ou, já encerrada, o início segue direto)
+    with lock_comando_pendente:
+        comando_pendente = None
+        if comando == "start" and thread_sistema and thread_sistema.is_alive() and status_sistema["status"] == "parando":
+            if guardar_pendente:
+                comando_pendente = comando
+            logging.info("Comando start recebido durante a finalização da execução anterior. Mantido pendente.")
+            return False
+    if comando == "start":
+        if status_sistema["status"] != "rodando":
+            logging.info("Processando comando start.")
+            executar_inicio()
+        else:
+            logging.info("Comando start recebido, mas o sistema já está rodando. Ignorando.")
+    elif comando == "stop":
+        if status_sistema["status"] != "parado":
+            logging.info("Processando comando stop.")
+            executar_parada()
+        else:
+            logging.info("Comando stop recebido, mas o sistema já está parado. Ignorando.")
+    return True
+
+
+def extrair_comando(mensagem):
+    """Extrai o comando de uma mensagem WebSocket (JSON {"command": ...} ou texto puro)."""
+    try:
+        dados = json.loads(mensagem)
+    except (TypeError, ValueError):
+        return str(mensagem).strip() or None
+    if isinstance(dados, dict):
+        return dados.get("command")
+    return dados if isinstance(dados, str) else None
+
+
+# Respostas ao handshake que indicam, de forma definitiva, que o servidor não oferece o canal WebSocket
+STATUS_SEM_WEBSOCKET = {404, 426}
+
+
+def status_handshake(erro):
+    """Status HTTP da resposta que recusou o handshake (InvalidStatus ou o legado InvalidStatusCode)."""
+    resposta = getattr(erro, "response", None)
+    return getattr(resposta, "status_code", None) or getattr(erro, "status_code", None)
+
+
+async def escutar_comandos():
+    """
+    Mantém uma conexão WebSocket com o servidor e executa os comandos recebidos assim que são enviados.
+    Em caso de queda ou de recusa transitória do handshake, reconecta com backoff exponencial (0,5 s até 30 s).
+
+    Returns:
+        bool: False se o servidor recusar o handshake de forma definitiva (STATUS_SEM_WEBSOCKET);
+        o chamador deve voltar ao polling.
+    """
+    url = f"{WS_SERVIDOR}/agent/{ID_MAQUINA}"
+    atraso = 0.5
+    while True:
+        try:
+            async with websockets.connect(url) as ws:
+                logging.info(f"Canal de comandos conectado via WebSocket: {url}")
+                atraso = 0.5
+                async for mensagem in ws:
+                    comando = extrair_comando(mensagem)
+                    if comando:
+                        # As ações locais são bloqueantes (aguardam a thread da execução e o
+                        # envio de status por HTTP); rodam fora do loop para não travá-lo
+                        await asyncio.to_thread(processar_comando, comando, True)
+        except websockets.InvalidHandshake as e:
+            if status_handshake(e) in STATUS_SEM_WEBSOCKET:
+                logging.warning(f"Servidor não oferece o canal WebSocket ({e}). Utilizando polling.")
+                return False
+            logging.error(f"Handshake WebSocket recusado: {e}. Reconectando em {atraso:.1f}s.")
+        except Exception as e:
+            logging.error(f"Conexão WebSocket de comandos perdida: {e}. Reconectando em {atraso:.1f}s.")
+        await asyncio.sleep(atraso + random.uniform(0, atraso))
+        atraso = min(atraso * 2, 30)
+
+
+def receber_comandos():
+    """Recebe comandos via WebSocket; se o servidor não suportar, recorre ao polling HTTP."""
+    if WS_SERVIDOR.startswith("ws") and asyncio.run(escutar_comandos()) is not False:
+        return
+    verificar_comandos()
 
 
 def verificar_comandos():
     """
     Faz polling para verificar se há comandos para iniciar ou parar o sistema.
+    Utilizado como alternativa quando o canal WebSocket não está disponível.
     Se houver comando e o status atual não corresponder à ação, executa a ação e limpa o comando.
     """
+    intervalo = 5
+    # Espera pelo resultado: o pior caso da requisição (conexão + leitura) com folga
+    espera = sum(TIMEOUT_HTTP) + 1
+    futuro = None
     while True:
         try:
-            resposta = requests.get(f"{URL_SERVIDOR}/machines", timeout=5)
+            if futuro is not None and not futuro.done():
+                # A requisição anterior ainda está em voo: pula este ciclo em vez de enfileirar outra
+                logging.warning("Polling anterior ainda em andamento. Ciclo ignorado.")
+                time.sleep(intervalo + random.uniform(0, 1))
+                continue
+            futuro = EXECUTOR_POLLING.submit(requisicao_servidor, "GET", f"{URL_SERVIDOR}/machines",
+                                             tentativas=1, timeout=TIMEOUT_HTTP)
+            try:
+                resposta = futuro.result(timeout=espera)
+            except FuturoTimeoutError:
+                raise TimeoutError(f"Servidor não respondeu ao polling em {espera}s.")
             if resposta.status_code == 200:
                 maquinas = resposta.json()
                 if ID_MAQUINA in maquinas:
                     comando = maquinas[ID_MAQUINA].get("command")
-                    if comando:
-                        if comando == "start":
-                            if status_sistema["status"] != "rodando":
-                                logging.info("Processando comando start.")
-                                requests.post("http://127.0.0.1:5001/start", timeout=5)
-                            else:
-                                logging.info("Comando start recebido, mas o sistema já está rodando. Ignorando.")
-                        elif comando == "stop":
-                            if status_sistema["status"] != "parado":
-                                logging.info("Processando comando stop.")
-                                requests.post("http://127.0.0.1:5001/stop", timeout=5)
-                            else:
-                                logging.info("Comando stop recebido, mas o sistema já está parado. Ignorando.")
-                        # Limpa o comando no servidor
-                        requests.post(f"{URL_SERVIDOR}/command", json={"id": ID_MAQUINA, "command": None}, timeout=5)
+                    # Só limpa o comando no servidor se ele foi tratado; um início recusado durante
+                    # a finalização da execução anterior fica pendente para o próximo ciclo
+                    if comando and processar_comando(comando):
+                        requisicao_servidor("POST", f"{URL_SERVIDOR}/command", json={"id": ID_MAQUINA, "command": None}, timeout=TIMEOUT_HTTP)
+            intervalo = 5
         except Exception as e:
             logging.error(f"Erro ao buscar comandos: {e}")
-        time.sleep(5) #Verificar a cada 5 segundos 
+            # Em falhas consecutivas, dobra o intervalo (até 60 s) para aliviar o servidor
+            intervalo = min(intervalo * 2, 60)
+        time.sleep(intervalo + random.uniform(0, 1))
 
 
-def kill_existing_agents():
+def monitorar_travamentos(limite=5.0, intervalo=1.0):
     """
-    Mata instâncias duplicadas do agente ao iniciar, sem matar o próprio processo.
-    Evita múltiplas instâncias simultâneas.
+    Watchdog do agente: acorda a cada `intervalo` segundos e, se o atraso observado superar `limite`,
+    registra um aviso (indício de travamento/GIL bloqueado) e publica o maior atraso em /status ("max_lag").
     """
-    pid_atual = os.getpid()
-    cmdline_atual = psutil.Process(pid_atual).cmdline()
-
-    for proc in psutil.process_iter(["pid", "name", "cmdline"]):
-        try:
-            cmdline = proc.info["cmdline"]
-            if cmdline and isinstance(cmdline, list):
-                if "agente" in " ".join(cmdline) and proc.info["pid"] != pid_atual:
-                    if cmdline == cmdline_atual:
-                        logging.warning(f"Evitando autoencerramento: {cmdline}")
-                        continue
-                    logging.info(f"Matando processo duplicado: PID {proc.info['pid']}")
-                    proc.kill()
-        except (psutil.NoSuchProcess, psutil.AccessDenied, TypeError) as e:
-            logging.warning(f"Erro ao processar processo {proc.info.get('pid')}: {e}")
+    global versao_status
+    ultimo = time.monotonic()
+    while True:
+        time.sleep(intervalo)
+        agora = time.monotonic()
+        atraso = agora - ultimo - intervalo
+        if atraso > limite:
+            logging.warning(f"Agente ficou travado por {atraso:.1f}s.")
+            if atraso > status_sistema["max_lag"]:
+                status_sistema["max_lag"] = round(atraso, 1)
+                versao_status += 1
+        ultimo = agora
+
+
+def adquirir_lock_instancia():
+    """
+    Garante uma única instância do agente por meio de um lock exclusivo do sistema operacional
+    (fcntl no Linux, msvcrt no Windows) em <logs>/agent.lock.
+    Se outro agente já detiver o lock, encerra este processo.
+    O arquivo permanece aberto (e o lock mantido) durante toda a vida do processo.
+    """
+    global arquivo_lock
+    caminho_lock = os.path.join(configurador.base_log_dir, "agent.lock")
+    arquivo_lock = open(caminho_lock, "a+")
+    try:
+        if sys.platform == "win32":
+            import msvcrt
+            arquivo_lock.seek(0)
+            msvcrt.locking(arquivo_lock.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(arquivo_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        logging.error(f"Outra instância do agente já está em execução (lock: {caminho_lock}). Encerrando.")
+        sys.exit(1)
+    arquivo_lock.seek(0)
+    arquivo_lock.truncate()
+    arquivo_lock.write(str(os.getpid()))
+    arquivo_lock.flush()
 
 
 def iniciar_agente():
     """Inicia o agente Flask e a verificação de comandos."""
-    kill_existing_agents()
+    adquirir_lock_instancia()
+    threading.Thread(target=processar_envios_status, name="envio-status", daemon=True).start()
+    # Atraso aleatório inicial evita que agentes reiniciados juntos registrem-se ao mesmo tempo
+    time.sleep(random.uniform(0, 5))
     registrar_status()
     logging.info(f"Agente iniciado em http://127.0.0.1:5001")
-    threading.Thread(target=verificar_comandos, daemon=True).start()
-    app.run(host="0.0.0.0", port=5001, debug=False, threaded=True, use_reloader=False)
+    threading.Thread(target=receber_comandos, daemon=True).start()
+    threading.Thread(target=monitorar_travamentos, name="watchdog", daemon=True).start()
+    # Servidor WSGI de produção (waitress) com keep-alive, no lugar do servidor de desenvolvimento do Flask
+    serve(app, host="0.0.0.0", port=5001, threads=8, connection_limit=200, channel_timeout=120)
 
 
 if __name__ == "__main__":
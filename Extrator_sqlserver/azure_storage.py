@@ -1,36 +1,161 @@
 import os
+import re
 import sys
 import asyncio
+import atexit
 import logging
+import random
+import threading
 import aiofiles
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, List, Set, Tuple
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Dict, List, Optional, Set, Tuple
 
 # Cliente síncrono para limpeza
 from azure.storage.blob import BlobServiceClient as BlobServiceClientSync
+from azure.storage.blob import ContainerClient as ContainerClientSync
+from azure.storage.blob import ExponentialRetry as ExponentialRetrySync
 # Cliente assíncrono para upload
 from azure.storage.blob.aio import BlobServiceClient as BlobServiceClientAsync
+from azure.storage.blob.aio import ContainerClient as ContainerClientAsync
+from azure.storage.blob.aio import ExponentialRetry as ExponentialRetryAsync
+from azure.core.exceptions import HttpResponseError
+from azure.core.pipeline.transport import AioHttpTransport, RequestsTransport
 
 # --------------------------------------------------
 # CONFIGURAÇÃO DE LOG
 # --------------------------------------------------
 logging.basicConfig(level=logging.INFO)
 
+# --------------------------------------------------
+# TRANSPORTES HTTP (POOL DE CONEXÕES)
+# --------------------------------------------------
+# Conexões mantidas por host no cliente síncrono (o padrão do urllib3 é 10, o que gera
+# "Connection pool is full" e novos handshakes TLS sob concorrência)
+TAMANHO_POOL_AZURE = 64
+
+def criar_transporte_sync(tamanho_pool: int = TAMANHO_POOL_AZURE) -> RequestsTransport:
+    """Cria o transporte do cliente síncrono com um pool urllib3 dimensionado para a concorrência."""
+    sessao = requests.Session()
+    adaptador = HTTPAdapter(pool_connections=tamanho_pool, pool_maxsize=tamanho_pool, pool_block=True)
+    sessao.mount("https://", adaptador)
+    return RequestsTransport(session=sessao, session_owner=False)
+
+def criar_transporte_async(limite_conexoes: int) -> AioHttpTransport:
+    """
+    Cria o transporte aiohttp com limite de conexões igual à concorrência desejada.
+    Deve ser chamado dentro do event loop; a sessão é fechada junto com o cliente.
+    """
+    sessao = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=limite_conexoes))
+    return AioHttpTransport(session=sessao, session_owner=True)
+
+# --------------------------------------------------
+# POLÍTICA DE RETENTATIVA (THROTTLING 429/500/503)
+# --------------------------------------------------
+def criar_politica_retry_sync() -> ExponentialRetrySync:
+    """Backoff exponencial (1s, 3s, 9s, ...) para respostas de throttling do serviço."""
+    return ExponentialRetrySync(initial_backoff=1, increment_base=3, retry_total=10)
+
+def criar_politica_retry_async() -> ExponentialRetryAsync:
+    """Mesma política de criar_politica_retry_sync, para os clientes assíncronos."""
+    return ExponentialRetryAsync(initial_backoff=1, increment_base=3, retry_total=10)
+
+# --------------------------------------------------
+# EVENT LOOP E CLIENTE ASSÍNCRONO COMPARTILHADOS
+# --------------------------------------------------
+# O cliente assíncrono (e sua sessão aiohttp) fica preso ao event loop em que foi criado;
+# por isso os uploads rodam num único loop de longa duração em vez de um asyncio.run por chamada.
+_loop_azure: Optional[asyncio.AbstractEventLoop] = None
+_lock_loop_azure = threading.Lock()
+# Clientes por conta (nome, chave): o azure_config é recriado a cada execução do main,
+# mas o processo do agente é longo, então os clientes sobrevivem entre execuções
+_clientes_async: Dict[Tuple[str, str], BlobServiceClientAsync] = {}
+_clientes_sync: Dict[Tuple[str, str], BlobServiceClientSync] = {}
+_lock_clientes_sync = threading.Lock()
+
+def chave_conta(azure_config: dict) -> Tuple[str, str]:
+    """Chave de cache dos clientes: nome e chave da conta."""
+    return azure_config["account_name"], azure_config["account_key"]
+
+def obter_loop_azure() -> asyncio.AbstractEventLoop:
+    """Retorna o event loop dedicado ao Azure, iniciando-o numa thread daemon na primeira chamada."""
+    global _loop_azure
+    with _lock_loop_azure:
+        if _loop_azure is None:
+            _loop_azure = asyncio.new_event_loop()
+            threading.Thread(target=_loop_azure.run_forever, name="azure-loop", daemon=True).start()
+        return _loop_azure
+
+def executar_no_loop_azure(coro):
+    """Executa a corrotina no loop dedicado ao Azure e aguarda o resultado (bloqueante)."""
+    return asyncio.run_coroutine_threadsafe(coro, obter_loop_azure()).result()
+
+def obter_cliente_async(azure_config: dict, max_concurrency: int) -> BlobServiceClientAsync:
+    """
+    Retorna o BlobServiceClient assíncrono da conta, criando-o na primeira chamada do processo,
+    e o guarda também em azure_config. Deve ser chamado dentro do loop do Azure (a criação
+    não tem await, então não há corrida).
+    """
+    cliente = azure_config.get("blob_service_client_async")
+    if cliente is None:
+        chave = chave_conta(azure_config)
+        cliente = _clientes_async.get(chave)
+        if cliente is None:
+            cliente = BlobServiceClientAsync(
+                account_url=f"https://{azure_config['account_name']}.blob.core.windows.net",
+                credential=azure_config["account_key"],
+                transport=criar_transporte_async(max_concurrency),
+                retry_policy=criar_politica_retry_async(),
+                # Arquivos acima de 8 MiB vão em blocos: a memória por upload fica limitada ao bloco
+                max_single_put_size=LIMITE_PUT_UNICO_AZURE,
+                max_block_size=TAMANHO_BLOCO_AZURE
+            )
+            _clientes_async[chave] = cliente
+        azure_config["blob_service_client_async"] = cliente
+    return cliente
+
+def encerrar_clientes_async():
+    """Fecha os clientes assíncronos compartilhados e para o loop do Azure ao final do processo."""
+    if _loop_azure is None:
+        return
+    async def fechar():
+        for cliente in _clientes_async.values():
+            await cliente.close()
+    try:
+        asyncio.run_coroutine_threadsafe(fechar(), _loop_azure).result(timeout=10)
+    except Exception as e:
+        logging.warning(f"Erro ao fechar clientes assíncronos do Azure: {e}")
+    _loop_azure.call_soon_threadsafe(_loop_azure.stop)
+
+atexit.register(encerrar_clientes_async)
+
 # --------------------------------------------------
 # VALIDAÇÃO DA CONFIGURAÇÃO AZURE
 # --------------------------------------------------
 def validar_config_azure(azure_config):
     """Valida e inicializa a configuração do Azure se necessário."""
     if "blob_service_client" not in azure_config:
-        from azure.storage.blob import BlobServiceClient
         if "account_name" in azure_config and "account_key" in azure_config:
-            azure_config["blob_service_client"] = BlobServiceClient(
-                account_url=f"https://{azure_config['account_name']}.blob.core.windows.net",
-                credential=azure_config["account_key"]
-            )
-            logging.info("Conexão com o Azure inicializada com sucesso (cliente síncrono).")
+            # Um cliente por conta no processo, compartilhado entre threads e execuções
+            with _lock_clientes_sync:
+                chave = chave_conta(azure_config)
+                if chave not in _clientes_sync:
+                    _clientes_sync[chave] = BlobServiceClientSync(
+                        account_url=f"https://{azure_config['account_name']}.blob.core.windows.net",
+                        credential=azure_config["account_key"],
+                        transport=criar_transporte_sync(),
+                        retry_policy=criar_politica_retry_sync()
+                    )
+                    logging.info("Conexão com o Azure inicializada com sucesso (cliente síncrono).")
+            azure_config["blob_service_client"] = _clientes_sync[chave]
         else:
             raise ValueError("Configuração do Azure está incompleta. Forneça 'account_name' e 'account_key'.")
+    if "container_client" not in azure_config and azure_config.get("container_name"):
+        # ContainerClient criado uma única vez e reutilizado em listagens e deleções
+        azure_config["container_client"] = azure_config["blob_service_client"].get_container_client(
+            azure_config["container_name"]
+        )
     return azure_config
 
 # --------------------------------------------------
@@ -41,11 +166,10 @@ def normalizar_particao(particao: str) -> str:
     return particao.rstrip("/")
 
 def formatar_particoes_log(particoes: Set[str], nivel: str) -> str:
-    """Formata as partições para log (primeira, última e total) usando strings normalizadas."""
+    """Formata as partições para log (primeira, última e total); recebe strings já normalizadas."""
     if not particoes:
         return ""
-    norm = {normalizar_particao(p) for p in particoes}
-    particoes_ordenadas = sorted(norm)
+    particoes_ordenadas = sorted(particoes)
     total = len(particoes_ordenadas)
     if total == 1:
         return f"{nivel}: {particoes_ordenadas[0]} (1 partição)"
@@ -54,35 +178,74 @@ def formatar_particoes_log(particoes: Set[str], nivel: str) -> str:
 # --------------------------------------------------
 # FUNÇÕES DE LISTAGEM E EXTRAÇÃO DE PARTIÇÕES (SÍNCRONAS)
 # --------------------------------------------------
-def obter_blobs_azure_sync(blob_service_client: BlobServiceClientSync, container_name: str, prefix: str) -> List:
-    """Lista todos os blobs no container que começam com o prefixo informado."""
-    container_client = blob_service_client.get_container_client(container_name)
-    return list(container_client.list_blobs(name_starts_with=prefix))
+def obter_blobs_azure_sync(container_client: ContainerClientSync, prefix: str) -> List[str]:
+    """
+    Lista os nomes de todos os blobs no container que começam com o prefixo informado.
+    list_blob_names desserializa apenas o nome de cada item (sem montar BlobProperties)
+    e usa páginas com o máximo de 5000 itens do serviço, reduzindo o número de requisições.
+    """
+    return list(container_client.list_blob_names(name_starts_with=prefix, results_per_page=5000))
 
-def extrair_particoes_dos_blobs(blobs: List) -> Set[str]:
+def agrupar_blobs_por_particao(blob_names: List[str], prefixo: str) -> Dict[str, List[str]]:
     """
-    Extrai as partições a partir dos nomes dos blobs, removendo o último segmento (nome do arquivo)
-    e normalizando a string.
+    Agrupa, em uma única passada, os nomes dos blobs pela partição a que pertencem.
+    A partição é o caminho sem o último segmento (nome do arquivo), normalizado e sem o
+    prefixo remoto (resultando em "idEmpresa=XYZ/..."). Marcadores de diretório (terminados
+    em "/") definem a partição, mas não entram na lista de blobs.
     """
-    return {normalizar_particao("/".join(blob.name.split("/")[:-1])) for blob in blobs}
+    inicio = normalizar_particao(prefixo) + "/"
+    grupos: Dict[str, List[str]] = {}
+    for nome in blob_names:
+        particao = normalizar_particao(nome.rpartition("/")[0])
+        if particao.startswith(inicio):
+            particao = normalizar_particao(particao[len(inicio):])
+        nomes = grupos.setdefault(particao, [])
+        if not nome.endswith("/"):
+            nomes.append(nome)
+    return grupos
+
+def raizes_particoes(particoes: Set[str]) -> Set[str]:
+    """Retorna as partições que não estão contidas em nenhuma outra do conjunto (já normalizado)."""
+    def tem_ancestral(p: str) -> bool:
+        fim = p.rfind("/")
+        while fim > 0:
+            if p[:fim] in particoes:
+                return True
+            fim = p.rfind("/", 0, fim)
+        return False
+    return {p for p in particoes if not tem_ancestral(p)}
 
 def filtrar_particoes_existentes(particoes_existentes: Set[str], particoes_recarregadas: Set[str]) -> Set[str]:
     """
     Retém somente as partições existentes que estejam contidas no conjunto de partições recarregadas.
-    As comparações são feitas com strings normalizadas.
+    Ambos os conjuntos devem chegar já normalizados (ver selecionar_blobs_para_exclusao).
     """
-    recarregadas_norm = {normalizar_particao(r) for r in particoes_recarregadas}
     def pertence_recarregadas(p: str) -> bool:
-        p_norm = normalizar_particao(p)
-        for rec in recarregadas_norm:
-            if p_norm == rec or p_norm.startswith(rec + "/"):
+        # Testa a própria partição e cada prefixo "a/b/..." por pertinência ao conjunto
+        if p in particoes_recarregadas:
+            return True
+        fim = p.rfind("/")
+        while fim > 0:
+            if p[:fim] in particoes_recarregadas:
                 return True
+            fim = p.rfind("/", 0, fim)
         return False
     return {p for p in particoes_existentes if pertence_recarregadas(p)}
 
 # --------------------------------------------------
 # FUNÇÃO DE DEFINIÇÃO DE PARTIÇÕES PARA EXCLUSÃO
 # --------------------------------------------------
+PADRAO_PARTICAO = re.compile(r"^(idEmpresa=[^/]+)(?:/(Ano=[^/]+))?(?:/(Mes=[^/]+))?")
+
+def interpretar_particoes(particoes: Set[str]) -> Dict[str, Tuple[str, Optional[str], Optional[str]]]:
+    """Extrai a tupla (idEmpresa, Ano, Mes) de cada partição (já normalizada)."""
+    resultado = {}
+    for p in particoes:
+        m = PADRAO_PARTICAO.match(p)
+        if m:
+            resultado[p] = m.groups()
+    return resultado
+
 def definir_particoes_para_exclusao(particoes_existentes: Set[str], particoes_recarregadas: Set[str]) -> Dict[str, Set[str]]:
     """
     Define as partições a serem excluídas de acordo com o tipo de consulta:
@@ -90,197 +253,286 @@ def definir_particoes_para_exclusao(particoes_existentes: Set[str], particoes_re
         a exclusão será feita a nível de idEmpresa.
       - Tipo B (idEmpresa + Data): Se houver informações de data, avalia os níveis Dia, Mes e Ano,
         excluindo somente os dados que estão sendo recarregados.
-    Todas as comparações são feitas com strings normalizadas.
+    Ambos os conjuntos devem chegar já normalizados (ver selecionar_blobs_para_exclusao).
     """
     if not particoes_existentes:
         return {}
 
-    particoes_recarregadas_norm = {normalizar_particao(r) for r in particoes_recarregadas}
-    tem_data = any(token in r for r in particoes_recarregadas_norm for token in ("Ano=", "Mes="))
+    recarregadas = interpretar_particoes(particoes_recarregadas)
+    existentes = interpretar_particoes(particoes_existentes)
+
+    # Índices das partições existentes por idEmpresa e por (idEmpresa, Ano)
+    existentes_por_empresa: Dict[str, Set[str]] = {}
+    existentes_por_ano: Dict[Tuple[str, str], Set[str]] = {}
+    for p_norm, (id_empresa, ano, _) in existentes.items():
+        existentes_por_empresa.setdefault(id_empresa, set()).add(p_norm)
+        if ano is not None:
+            existentes_por_ano.setdefault((id_empresa, ano), set()).add(p_norm)
+
+    id_empresas = {id_empresa for id_empresa, _, _ in recarregadas.values()}
+    tem_data = any(ano is not None or mes is not None for _, ano, mes in recarregadas.values())
     if not tem_data:
-        exclusao = {"idEmpresa": set()}
-        id_empresas = {normalizar_particao(r).split("/")[0] for r in particoes_recarregadas_norm if "idEmpresa=" in r}
-        for id_empresa in id_empresas:
-            if any(normalizar_particao(p).startswith(id_empresa) for p in particoes_existentes):
-                exclusao["idEmpresa"].add(id_empresa)
-        return exclusao
-    else:
-        exclusao = {"Mes": set(), "Ano": set(), "idEmpresa": set()}
-        exclusao["Mes"] = {normalizar_particao(r) for r in particoes_recarregadas_norm if all(token in r for token in ("Ano=", "Mes="))}
-        anos_map: Dict[str, Set[str]] = {}
-        for mes in exclusao["Mes"]:
-            ano = mes.split("/")[0]
-            anos_map.setdefault(ano, set()).add(mes)
-        for ano, meses_recarregados in anos_map.items():
-            meses_existentes = {normalizar_particao(p) for p in particoes_existentes if normalizar_particao(p).startswith(ano)}
-            if meses_existentes and meses_existentes == meses_recarregados:
-                exclusao["Ano"].add(ano)
-        particoes_excluidas = exclusao["Mes"] | exclusao["Ano"]
-        id_empresas = {normalizar_particao(r).split("/")[0] for r in particoes_recarregadas_norm if "idEmpresa=" in r}
-        for id_empresa in id_empresas:
-            particoes_empresa = {normalizar_particao(p) for p in particoes_existentes if normalizar_particao(p).startswith(id_empresa)}
-            if particoes_empresa and particoes_empresa.issubset(particoes_excluidas):
-                exclusao["idEmpresa"].add(id_empresa)
-            else:
-                logging.info(f"{id_empresa} NÃO será excluída pois possui partições válidas não recarregadas.")
-        return exclusao
+        return {"idEmpresa": {id_empresa for id_empresa in id_empresas if id_empresa in existentes_por_empresa}}
+
+    exclusao = {"Mes": set(), "Ano": set(), "idEmpresa": set()}
+    meses_por_ano: Dict[Tuple[str, str], Set[str]] = {}
+    for p_norm, (id_empresa, ano, mes) in recarregadas.items():
+        if ano is not None and mes is not None:
+            exclusao["Mes"].add(p_norm)
+            meses_por_ano.setdefault((id_empresa, ano), set()).add(p_norm)
+    for (id_empresa, ano), meses_recarregados in meses_por_ano.items():
+        meses_existentes = existentes_por_ano.get((id_empresa, ano))
+        if meses_existentes and meses_existentes == meses_recarregados:
+            exclusao["Ano"].add(f"{id_empresa}/{ano}")
+    particoes_excluidas = exclusao["Mes"] | exclusao["Ano"]
+    for id_empresa in id_empresas:
+        particoes_empresa = existentes_por_empresa.get(id_empresa)
+        if particoes_empresa and particoes_empresa.issubset(particoes_excluidas):
+            exclusao["idEmpresa"].add(id_empresa)
+        else:
+            logging.info(f"{id_empresa} NÃO será excluída pois possui partições válidas não recarregadas.")
+    return exclusao
 # --------------------------------------------------
-# FUNÇÃO DE DELEÇÃO EM BATCH (SÍNCRONA) PARA AZURE
+# FUNÇÃO DE DELEÇÃO EM BATCH (ASSÍNCRONA) PARA AZURE
 # --------------------------------------------------
+# Limite do serviço: no máximo 256 subrequisições por requisição Blob Batch
+TAMANHO_LOTE_AZURE = 256
+
 def chunk_list(lst: List, chunk_size: int):
     """Divide uma lista em chunks de tamanho chunk_size."""
     for i in range(0, len(lst), chunk_size):
         yield lst[i:i + chunk_size]
 
-def executar_exclusao_blobs_batch(blob_service_client: BlobServiceClientSync,
-                                  container_name: str,
-                                  blob_names: List[str],
-                                  max_workers: int = 10,
-                                  dry_run: bool = False,
-                                  nome_consulta: str = "") -> None:
+# Status de throttling/indisponibilidade: a subrequisição é reenviada em vez de contar como falha
+STATUS_THROTTLING_AZURE = {429, 500, 503}
+TENTATIVAS_LOTE_AZURE = 5
+
+async def excluir_lote_async(container_client,
+                             chunk: List[str],
+                             tentativa: int = 0) -> Optional[Tuple[Exception, List[str]]]:
     """
-    Realiza a deleção em batch dos blobs usando o método delete_blobs do ContainerClient.
-    Divide a lista em chunks (até 256 blobs por lote) e executa em paralelo.
+    Deleta um lote de até 256 blobs em uma única requisição Blob Batch.
+    A política de retry do cliente cobre o throttling da requisição inteira; subrequisições
+    recusadas por throttling dentro do lote são reenviadas com backoff, em lotes com metade
+    do tamanho, até TENTATIVAS_LOTE_AZURE vezes.
+    Retorna None em caso de sucesso ou (erro, blobs com falha).
     """
-    if dry_run:
-        logging.info(f"[{nome_consulta}] Dry run ativado: {len(blob_names)} blobs seriam deletados.")
-        return
+    falhas = []
+    limitados = []
+    try:
+        respostas = await container_client.delete_blobs(*chunk, raise_on_any_failure=False)
+        # 404 indica blob já removido; qualquer outro status >= 300 é falha
+        indice = 0
+        async for resposta in respostas:
+            if resposta.status_code in STATUS_THROTTLING_AZURE:
+                limitados.append(chunk[indice])
+            elif resposta.status_code >= 300 and resposta.status_code != 404:
+                falhas.append(chunk[indice])
+            indice += 1
+    except HttpResponseError as e:
+        if e.status_code not in STATUS_THROTTLING_AZURE:
+            return e, chunk
+        limitados = chunk
+    except Exception as e:
+        return e, chunk
+
+    if limitados and tentativa < TENTATIVAS_LOTE_AZURE:
+        espera = min(2 ** tentativa, 30) + random.uniform(0, 1)
+        logging.warning(f"Throttling na deleção: {len(limitados)} blobs serão reenviados em {espera:.1f}s "
+                        f"(tentativa {tentativa + 1}/{TENTATIVAS_LOTE_AZURE}).")
+        await asyncio.sleep(espera)
+        for parte in chunk_list(limitados, max(1, (len(limitados) + 1) // 2)):
+            resultado = await excluir_lote_async(container_client, parte, tentativa + 1)
+            if resultado is not None:
+                falhas.extend(resultado[1])
+    else:
+        falhas.extend(limitados)
 
-    # Obtém o container_client
-    container_client = blob_service_client.get_container_client(container_name)
-    errors = []
+    if falhas:
+        return Exception(f"{len(falhas)} blobs não foram deletados no lote"), falhas
+    return None
 
-    def delete_batch(chunk: List[str]):
-        try:
-            # Usa o método delete_blobs diretamente no container_client
-            container_client.delete_blobs(*chunk, raise_on_any_failure=True)
-        except Exception as e:
-            return e, chunk
-        return None
+async def executar_exclusao_blobs_batch_async(container_client: ContainerClientAsync,
+                                              blob_names: List[str],
+                                              max_in_flight: int,
+                                              tamanho_lote: int = TAMANHO_LOTE_AZURE) -> List[Tuple[Exception, List[str]]]:
+    """
+    Executa a deleção com no máximo `max_in_flight` lotes em voo: um número fixo de tarefas
+    consome os lotes sob demanda, em vez de criar de antemão uma tarefa por lote.
+    Retorna a lista de erros (erro, blobs) encontrados.
+    """
+    # Gerador compartilhado: cada tarefa obtém o próximo lote somente quando termina o anterior
+    lotes = chunk_list(blob_names, tamanho_lote)
+    total_lotes = -(-len(blob_names) // tamanho_lote)
+
+    async def consumir_lotes() -> List[Tuple[Exception, List[str]]]:
+        erros = []
+        for chunk in lotes:
+            resultado = await excluir_lote_async(container_client, chunk)
+            if resultado is not None:
+                erros.append(resultado)
+        return erros
+
+    resultados = await asyncio.gather(
+        *(consumir_lotes() for _ in range(max(1, min(max_in_flight, total_lotes))))
+    )
+    return [erro for erros in resultados for erro in erros]
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(delete_batch, chunk): chunk for chunk in chunk_list(blob_names, 256)}
-        for future in as_completed(futures):
-            result = future.result()
-            if result is not None:
-                err, chunk = result
-                errors.append((err, chunk))
-                logging.error(f"[{nome_consulta}] Erro ao deletar lote: {err}. Blobs: {chunk}")
+def registrar_resultado_exclusao(errors: List[Tuple[Exception, List[str]]], total: int, nome_consulta: str = "") -> None:
+    """Registra os erros da deleção em batch e lança exceção se algum lote falhou."""
+    for err, chunk in errors:
+        logging.error(f"[{nome_consulta}] Erro ao deletar lote: {err}. Blobs: {chunk}")
 
     if errors:
         logging.error(f"[{nome_consulta}] Erros durante a deleção em batch: {errors}")
         raise Exception("Falha na deleção em batch de blobs.")
     else:
-        logging.info(f"[{nome_consulta}] Deleção em batch concluída com sucesso para {len(blob_names)} blobs.")
+        logging.info(f"[{nome_consulta}] Deleção em batch concluída com sucesso para {total} blobs.")
 
-def limpar_prefixo_no_azure(blob_service_client: BlobServiceClientSync, container_name: str, caminho_destino: str,
-                             particoes_recarregadas: List[str], workers: int = 10, dry_run: bool = False,
-                             nome_consulta: str = "") -> None:
+def selecionar_blobs_para_exclusao(container_client: ContainerClientSync, caminho_destino: str,
+                                   particoes_recarregadas: List[str], nome_consulta: str = "") -> List[str]:
+    """
+    Lista uma única vez cada raiz recarregada (ex.: "idEmpresa=XYZ/") e retorna os nomes dos
+    blobs das partições recarregadas que devem ser excluídos (lista vazia quando não há o que limpar).
+    """
     if not particoes_recarregadas:
         logging.info(f"[{nome_consulta}] Nenhuma partição para exclusão no Azure.")
-        return
+        return []
+    # Normaliza uma única vez na entrada; as funções abaixo recebem conjuntos já normalizados
+    recarregadas_norm = {normalizar_particao(r) for r in particoes_recarregadas}
 
-    blobs = obter_blobs_azure_sync(blob_service_client, container_name, caminho_destino)
-    particoes_existentes = extrair_particoes_dos_blobs(blobs)
+    # Só interessam partições sob as recarregadas: lista apenas as raízes recarregadas, sem
+    # trazer os arquivos das demais empresas. O "/" final evita prefixos irmãos
+    # (ex.: "Vendas" não deve listar "VendasItens", "idEmpresa=1" não deve listar "idEmpresa=10")
+    base = normalizar_particao(caminho_destino)
+    blobs = []
+    for raiz in sorted(raizes_particoes(recarregadas_norm)):
+        blobs.extend(obter_blobs_azure_sync(container_client, f"{base}/{raiz}/"))
+    if not blobs:
+        # Prefixo ainda vazio (ex.: primeira extração): não há o que limpar
+        logging.info(f"[{nome_consulta}] Prefixo '{caminho_destino}' vazio no Azure. Limpeza ignorada.")
+        return []
+    # Mapeia partição normalizada ("idEmpresa=XYZ/...", sem o prefixo remoto) -> blobs, a partir da listagem única
+    blobs_por_particao = agrupar_blobs_por_particao(blobs, caminho_destino)
     # Filtra apenas aquelas que contenham "idEmpresa="
-    particoes_existentes = {normalizar_particao(p) for p in particoes_existentes if "idEmpresa=" in p}
-    # Remove o prefixo remoto (caminho_destino) se presente, para que o resultado seja apenas "idEmpresa=XYZ/..."
-    prefixo = normalizar_particao(caminho_destino)
-    particoes_existentes = {
-        normalizar_particao(p[len(prefixo)+1:]) if p.startswith(prefixo + "/") else normalizar_particao(p)
-        for p in particoes_existentes
-    }
+    particoes_existentes = {p for p in blobs_por_particao if "idEmpresa=" in p}
     # Agora compara com as partições recarregadas (que devem conter apenas o final do caminho)
-    particoes_existentes = filtrar_particoes_existentes(particoes_existentes, {normalizar_particao(r) for r in particoes_recarregadas})
+    particoes_existentes = filtrar_particoes_existentes(particoes_existentes, recarregadas_norm)
     if not particoes_existentes:
         logging.info(f"[{nome_consulta}] Nenhuma partição existente (pertencente à recarga) encontrada para o prefixo '{caminho_destino}'.")
-        return
+        return []
 
-    exclusao = definir_particoes_para_exclusao(particoes_existentes, {normalizar_particao(r) for r in particoes_recarregadas})
+    exclusao = definir_particoes_para_exclusao(particoes_existentes, recarregadas_norm)
     if not exclusao:
         logging.info(f"[{nome_consulta}] Não há partições marcadas para exclusão.")
-        return
+        return []
 
     for nivel, parts in exclusao.items():
         log_msg = formatar_particoes_log(parts, nivel)
         if log_msg:
             logging.info(f"[{nome_consulta}] Exclusão no nível {nivel}: {log_msg}")
 
-    blob_names = []
-    container_client = blob_service_client.get_container_client(container_name)
-    for nivel, parts in exclusao.items():
-        for particao in parts:
-            prefixo_completo = f"{caminho_destino}/{particao}".rstrip("/") + "/"
-            blobs_part = list(container_client.list_blobs(name_starts_with=prefixo_completo))
-            blob_names.extend([blob.name for blob in blobs_part if not blob.name.endswith("/")])
+    # A listagem inicial já contém todos os blobs sob caminho_destino: seleciona, no mapa
+    # partição -> blobs, as partições excluídas e suas subpartições, sem listar novamente
+    particoes_excluidas = {particao for parts in exclusao.values() for particao in parts}
+    prefixos_exclusao = tuple(particao + "/" for particao in particoes_excluidas)
+    blob_names = [
+        nome
+        for particao, nomes in blobs_por_particao.items()
+        if particao in particoes_excluidas or particao.startswith(prefixos_exclusao)
+        for nome in nomes
+    ]
 
     if not blob_names:
         logging.info(f"[{nome_consulta}] Nenhum blob encontrado para exclusão no Azure.")
-        return
+        return []
 
     logging.info(f"[{nome_consulta}] {len(blob_names)} blobs serão deletados (processo crítico).")
-    executar_exclusao_blobs_batch(blob_service_client, container_name, blob_names,
-                                  max_workers=workers, dry_run=dry_run, nome_consulta=nome_consulta)
+    return blob_names
 
 # --------------------------------------------------
 # FUNÇÕES DE UPLOAD ASSÍNCRONO – AZURE
 # --------------------------------------------------
+# Até este tamanho o SDK envia o arquivo em um único Put Blob, lendo-o inteiro para a memória;
+# acima dele usa Put Block/Put Block List, lendo um bloco (TAMANHO_BLOCO_AZURE) por vez. O padrão
+# do SDK (64 MiB) cobre a maioria das partes Parquet, por isso o cliente é criado com limites
+# menores (ver obter_cliente_async) e, nos arquivos divididos, vale paralelizar os blocos
+LIMITE_PUT_UNICO_AZURE = 8 * 1024 * 1024
+TAMANHO_BLOCO_AZURE = 8 * 1024 * 1024
+CONCORRENCIA_BLOCOS_AZURE = 4
+# Uploads em voo por conta somando todos os envios simultâneos: o cliente compartilhado é
+# dimensionado por ele, e cada envio recebe a sua fração em max_concurrency (ver storage.py)
+UPLOADS_CONCORRENTES_AZURE = 64
+
 async def upload_file_async(semaphore: asyncio.Semaphore,
-                            blob_service_client: BlobServiceClientAsync,
-                            container_name: str,
+                            container_client: ContainerClientAsync,
                             local_path: str,
-                            destino_blob: str) -> str:
+                            destino_blob: str,
+                            tamanho: Optional[int] = None) -> str:
     """
     Realiza o upload assíncrono de um único arquivo para o Azure Blob Storage,
     utilizando um semáforo para limitar a concorrência.
+    O arquivo é enviado em streaming: acima de LIMITE_PUT_UNICO_AZURE o SDK lê e envia blocos
+    (Put Block/Put Block List) sem carregar o arquivo inteiro em memória; abaixo dele o arquivo,
+    de no máximo um bloco, vai num único Put Blob.
     """
     async with semaphore:
         try:
+            blob_client = container_client.get_blob_client(destino_blob)
+            if tamanho is None:
+                tamanho = os.path.getsize(local_path)
             async with aiofiles.open(local_path, "rb") as f:
-                data = await f.read()
-            blob_client = blob_service_client.get_blob_client(container=container_name, blob=destino_blob)
-            await blob_client.upload_blob(data, overwrite=True)
+                await blob_client.upload_blob(
+                    f,
+                    overwrite=True,
+                    length=tamanho,
+                    # O paralelismo já vem do semáforo entre arquivos: um bloco por vez por blob
+                    # limita a memória a O(tamanho do bloco × uploads concorrentes), com até
+                    # CONCORRENCIA_BLOCOS_AZURE blocos nos arquivos acima do limite de Put Blob único.
+                    max_concurrency=CONCORRENCIA_BLOCOS_AZURE if tamanho > LIMITE_PUT_UNICO_AZURE else 1,
+                    blob_type="BlockBlob"
+                )
          #   logging.info(f"Upload realizado: {destino_blob}")
             return destino_blob
         except Exception as e:
             logging.error(f"Erro ao fazer upload de '{destino_blob}': {e}")
             raise
 
+def definir_destino_blob(temp_dir: str, caminho_destino: str, file_path: str) -> str:
+    """Nome do blob de destino de um arquivo local: caminho_destino + caminho relativo a temp_dir."""
+    relative_path = os.path.relpath(file_path, temp_dir).replace(os.sep, "/")
+    return f"{caminho_destino}/{relative_path}"
+
 async def realizar_upload_azure_async(temp_dir: str,
                                       caminho_destino: str,
                                       azure_config: dict,
-                                      max_concurrency: int = 1000,
-                                      nome_consulta: str = "") -> dict:
+                                      max_concurrency: int = UPLOADS_CONCORRENTES_AZURE,
+                                      nome_consulta: str = "",
+                                      arquivos: Optional[List[Tuple[str, int]]] = None) -> dict:
     """
     Orquestra o upload assíncrono para o Azure Blob Storage:
-      1. Lista recursivamente todos os arquivos em temp_dir.
+      1. Lista recursivamente todos os arquivos em temp_dir (se `arquivos`, pares (caminho, tamanho),
+         não for informado).
       2. Para cada arquivo, determina o destino baseado em caminho_destino.
       3. Executa uploads concorrentes controlados por semáforo.
     """
-    # Cria o cliente assíncrono utilizando os mesmos dados de conexão
-    from azure.storage.blob.aio import BlobServiceClient as BlobServiceClientAsync
-    blob_service_client = BlobServiceClientAsync(
-        account_url=f"https://{azure_config['account_name']}.blob.core.windows.net",
-        credential=azure_config["account_key"]
-    )
-    container_name = azure_config["container_name"]
+    # Cliente assíncrono compartilhado entre chamadas (não é fechado aqui; ver encerrar_clientes_async)
+    blob_service_client = obter_cliente_async(azure_config, UPLOADS_CONCORRENTES_AZURE)
+    # Um único ContainerClient assíncrono para todos os uploads desta chamada
+    container_client = blob_service_client.get_container_client(azure_config["container_name"])
 
-    arquivos = []
-    for root, _, files in os.walk(temp_dir):
-        for file in files:
-            arquivos.append(os.path.join(root, file))
+    if arquivos is None:
+        _, arquivos = listar_particoes_e_arquivos(temp_dir, caminho_destino)
     if not arquivos:
         logging.info(f"[{nome_consulta}] Nenhum arquivo encontrado para upload em '{temp_dir}'.")
-        await blob_service_client.close()
         return {"enviados": [], "erros": []}
 
     logging.info(f"[{nome_consulta}] Iniciando upload de {len(arquivos)} arquivos para o Azure com {max_concurrency} uploads concorrentes...")
     semaphore = asyncio.Semaphore(max_concurrency)
     tasks = []
-    for file_path in arquivos:
-        relative_path = os.path.relpath(file_path, temp_dir).replace(os.sep, "/")
-        destino_blob = f"{caminho_destino}/{relative_path}"
-        tasks.append(upload_file_async(semaphore, blob_service_client, container_name, file_path, destino_blob))
+    for file_path, tamanho in arquivos:
+        destino_blob = definir_destino_blob(temp_dir, caminho_destino, file_path)
+        tasks.append(upload_file_async(semaphore, container_client, file_path, destino_blob, tamanho))
 
     enviados = []
     erros = []
@@ -291,47 +543,102 @@ async def realizar_upload_azure_async(temp_dir: str,
         else:
             enviados.append(result)
     logging.info(f"[{nome_consulta}] Upload concluído. Enviados: {len(enviados)}, Erros: {len(erros)}")
-    await blob_service_client.close()
     return {"enviados": enviados, "erros": erros}
 
+async def limpar_e_enviar_azure_async(temp_dir: str,
+                                      caminho_destino: str,
+                                      azure_config: dict,
+                                      blob_names: List[str],
+                                      arquivos: List[Tuple[str, int]],
+                                      workers: int = 10,
+                                      max_concurrency: int = UPLOADS_CONCORRENTES_AZURE,
+                                      dry_run: bool = False,
+                                      nome_consulta: str = "") -> dict:
+    """
+    Executa a deleção dos blobs antigos e o upload dos novos arquivos concorrentemente,
+    cada etapa com seu próprio limite (workers lotes de deleção / max_concurrency uploads).
+    Blobs que serão sobrescritos pelo upload saem da lista de deleção, de modo que as duas
+    etapas atuam sobre nomes disjuntos e a deleção nunca remove um arquivo recém-enviado.
+    """
+    destinos = {definir_destino_blob(temp_dir, caminho_destino, file_path) for file_path, _ in arquivos}
+    blob_names = [nome for nome in blob_names if nome not in destinos]
+
+    etapas = [realizar_upload_azure_async(temp_dir, caminho_destino, azure_config, max_concurrency,
+                                          nome_consulta, arquivos=arquivos)]
+    if blob_names and dry_run:
+        logging.info(f"[{nome_consulta}] Dry run ativado: {len(blob_names)} blobs seriam deletados.")
+    elif blob_names:
+        container_client = obter_cliente_async(azure_config, UPLOADS_CONCORRENTES_AZURE).get_container_client(
+            azure_config["container_name"])
+        etapas.append(executar_exclusao_blobs_batch_async(container_client, blob_names, workers))
+
+    resultados = await asyncio.gather(*etapas)
+    if len(resultados) > 1:
+        registrar_resultado_exclusao(resultados[1], len(blob_names), nome_consulta)
+    return resultados[0]
+
+# --------------------------------------------------
+# VARREDURA LOCAL DE PARTIÇÕES E ARQUIVOS
+# --------------------------------------------------
+def listar_particoes_e_arquivos(temp_dir: str, caminho_destino: str) -> Tuple[List[str], List[Tuple[str, int]]]:
+    """
+    Percorre temp_dir uma única vez (os.scandir) e retorna:
+      - as partições locais (diretórios com "idEmpresa="), relativas ao prefixo remoto;
+      - os pares (caminho, tamanho) de todos os arquivos a serem enviados, com o tamanho
+        obtido do DirEntry durante a varredura.
+    """
+    # Para alinhar as partições locais com o prefixo remoto,
+    # considere que os arquivos estão em <temp_dir>/<caminho_destino>/...
+    base_local = os.path.join(temp_dir, caminho_destino)
+    # Caso contrário, os arquivos estão organizados diretamente em temp_dir
+    base_particoes = base_local if os.path.isdir(base_local) else temp_dir
+    dentro_base = base_particoes + os.sep
+
+    particoes = []
+    arquivos = []
+    pendentes = [temp_dir]
+    while pendentes:
+        root = pendentes.pop()
+        if "idEmpresa=" in root and (root == base_particoes or root.startswith(dentro_base)):
+            particoes.append(os.path.relpath(root, base_particoes).replace(os.sep, "/"))
+        with os.scandir(root) as entradas:
+            for entrada in entradas:
+                if entrada.is_dir(follow_symlinks=False):
+                    pendentes.append(entrada.path)
+                elif entrada.is_file():
+                    arquivos.append((entrada.path, entrada.stat().st_size))
+
+    # Se a raiz (base_local) contém "idEmpresa=", garanta que seja incluída
+    if base_particoes == base_local and "idEmpresa=" in os.path.basename(base_local):
+        particoes.append(os.path.basename(base_local))
+    return particoes, arquivos
+
 # --------------------------------------------------
 # FUNÇÃO FINAL – INTEGRA LIMPEZA (SÍNCRONA) E UPLOAD (ASSÍNCRONO) PARA AZURE
 # --------------------------------------------------
 def realizar_upload_azure(temp_dir: str, caminho_destino: str, azure_config: dict,
-                           workers: int = 10, max_concurrency: int = 1000, dry_run: bool = False,
+                           workers: int = 10, max_concurrency: int = UPLOADS_CONCORRENTES_AZURE, dry_run: bool = False,
                            nome_consulta: str = "") -> dict:
     """
     Executa o fluxo completo para o Azure:
       1. Valida a configuração e inicializa o cliente síncrono se necessário.
-      2. Executa a limpeza das partições recarregadas (deleção em batch).
-      3. Realiza o upload assíncrono dos arquivos.
+      2. Seleciona os blobs das partições recarregadas a partir de uma listagem única.
+      3. Executa a deleção em batch e o upload assíncrono concorrentemente.
     """
     # 🔹 Reduzir logs desnecessários de HTTP
     logging.getLogger("azure.core.pipeline.policies.http_logging_policy").setLevel(logging.WARNING)
     logging.getLogger("urllib3").setLevel(logging.WARNING)
 
     azure_config = validar_config_azure(azure_config)
-    blob_service_client_sync = azure_config["blob_service_client"]
-    container_name = azure_config["container_name"]
+    container_client = azure_config["container_client"]
 
-    # Para alinhar as partições locais com o prefixo remoto,
-    # considere que os arquivos estão em <temp_dir>/<caminho_destino>/...
-    base_local = os.path.join(temp_dir, caminho_destino)
-    if os.path.isdir(base_local):
-        # Extrai partições relativas a partir de base_local
-        particoes = [os.path.relpath(root, base_local).replace(os.sep, "/")
-                     for root, _, _ in os.walk(base_local) if "idEmpresa=" in root]
-        # Se a raiz (base_local) contém "idEmpresa=", garanta que seja incluída
-        if "idEmpresa=" in os.path.basename(base_local):
-            particoes.append(os.path.basename(base_local))
-    else:
-        # Caso os arquivos estejam organizados diretamente em temp_dir
-        particoes = [os.path.relpath(root, temp_dir).replace(os.sep, "/")
-                     for root, _, _ in os.walk(temp_dir) if "idEmpresa=" in root]
+    # Uma única varredura de temp_dir fornece as partições (limpeza) e os arquivos (upload)
+    particoes, arquivos = listar_particoes_e_arquivos(temp_dir, caminho_destino)
 
-    # Executa a limpeza das partições recarregadas
-    limpar_prefixo_no_azure(blob_service_client_sync, container_name, caminho_destino,
-                             particoes, workers, dry_run, nome_consulta)
+    # Seleciona os blobs das partições recarregadas (listagem síncrona única)
+    blob_names = selecionar_blobs_para_exclusao(container_client, caminho_destino, particoes, nome_consulta)
 
-    # Em seguida, realiza o upload assíncrono
-    return asyncio.run(realizar_upload_azure_async(temp_dir, caminho_destino, azure_config, max_concurrency, nome_consulta))
+    # Deleção e upload sobrepostos no loop compartilhado (reaproveita o cliente e suas conexões)
+    return executar_no_loop_azure(limpar_e_enviar_azure_async(temp_dir, caminho_destino, azure_config,
+                                                              blob_names, arquivos, workers, max_concurrency,
+                                                              dry_run, nome_consulta))
@@ -153,59 +153,35 @@ def configurar_destino_parametros(parametros_mongo_empresas, parametros_mongo_nu
     destino_tipo = parametros_mongo_empresas.get("TipoDestino", "ambos").strip().lower()
     portal = parametros_mongo_empresas.get("portal", "pgfarma")
 
-    # Inicializar as configurações dos destinos
-    azure_config = None
-    s3_config = None
-
-   # Processar os documentos da nuvem para configurar Azure e S3
+    # Configuração de cada provedor, montada uma única vez (prevalece o último documento que o define)
+    por_provedor = {}
     for doc in parametros_mongo_nuvem:
         destino = doc.get("Destino", {})  # Captura o campo 'Destino'
 
         if "azure" in destino:
-            azure_config = {
+            por_provedor["azure"] = {
                 "account_name": destino["azure"].get("NomeConta"),
                 "account_key": destino["azure"].get("ChaveConta"),
                 "container_name": destino["azure"].get("NomeContainer")
             }
 
         if "s3" in destino:
-            s3_config = {
+            por_provedor["s3"] = {
                 "access_key": destino["s3"].get("ChaveAcesso"),
                 "secret_key": destino["s3"].get("ChaveSecreta"),
-                "bucket": destino["s3"].get("Bucket"),
+                # Bucket ausente fica vazio (validar_config_s3 recusa o envio ao S3), sem derrubar
+                # a leitura de configurações que só usam o Azure
+                "bucket": (destino["s3"].get("Bucket") or "").replace("s3://", "").split("/")[0],
                 "region": destino["s3"].get("Regiao")
             }
+
     # Configuração final com base no tipo de destino
-    if destino_tipo == "azure":
-        return "azure", portal, {
-            "azure": {
-                "account_name": destino["azure"].get("NomeConta"),
-                "account_key": destino["azure"].get("ChaveConta"),
-                "container_name": destino["azure"].get("NomeContainer")
-            }
-        }
-    elif destino_tipo == "s3":
-        return "s3", portal, {
-            "s3": {
-                "access_key": destino["s3"].get("ChaveAcesso"),
-                "secret_key": destino["s3"].get("ChaveSecreta"),
-                "bucket": destino["s3"].get("Bucket").replace("s3://", "").split("/")[0],
-                "region": destino["s3"].get("Regiao")            }
-        }
-    else:
-        return "ambos", portal, {
-            "azure": {
-                "account_name": destino["azure"].get("NomeConta"),
-                "account_key": destino["azure"].get("ChaveConta"),
-                "container_name": destino["azure"].get("NomeContainer")
-            },
-            "s3": {
-                "access_key": destino["s3"].get("ChaveAcesso"),
-                "secret_key": destino["s3"].get("ChaveSecreta"),
-                "bucket": destino["s3"].get("Bucket").replace("s3://", "").split("/")[0],
-                "region": destino["s3"].get("Regiao")
-            }
-        }
+    provedores = [destino_tipo] if destino_tipo in ("azure", "s3") else ["azure", "s3"]
+    faltantes = [provedor for provedor in provedores if provedor not in por_provedor]
+    if faltantes:
+        raise ValueError(f"Configuração de nuvem ausente para: {', '.join(faltantes)}.")
+    tipo = destino_tipo if destino_tipo in ("azure", "s3") else "ambos"
+    return tipo, portal, {provedor: por_provedor[provedor] for provedor in provedores}
 
 def configurar_conexao_banco(parametros_mongo: dict) -> dict:
     """
@@ -252,20 +228,43 @@ def obter_diretorio_temporario():
 
 
 
+# Configurações exportadas como dicionários; atualizados no lugar por carregar_configuracoes,
+# para que os módulos que fizeram `from config import ...` vejam os valores recarregados
+DATABASE_CONFIG = {}
+MONGO_CONFIG = {}
+STORAGE_CONFIG = {}
+GENERAL_CONFIG = {}
+
+
+def carregar_configuracoes(recarregar_env=False):
+    """
+    Instancia e valida as configurações e as publica nos dicionários do módulo.
+
+    Args:
+        recarregar_env (bool): Se True, relê o config/config.env, sobrescrevendo as variáveis
+            já carregadas. O agente executa o main no próprio processo, que só importa este
+            módulo uma vez; sem a releitura, alterações no arquivo exigiriam reiniciar o agente.
+
+    Raises:
+        EnvironmentError: Se faltar alguma variável obrigatória.
+    """
+    if recarregar_env:
+        load_dotenv(obter_caminho_recurso("config/config.env"), override=True)
+    novas = (
+        (DATABASE_CONFIG, DatabaseConfig()),
+        (MONGO_CONFIG, MongoConfig()),
+        (STORAGE_CONFIG, StorageConfig()),
+        (GENERAL_CONFIG, GeneralConfig()),
+    )
+    # Só publica depois de todas validadas: uma falha não deixa a configuração pela metade
+    for destino, config in novas:
+        destino.clear()
+        destino.update(config.to_dict())
+
+
 # Inicialização e validação das configurações
 try:
-    # Instanciar e validar configurações
-    database_config = DatabaseConfig()
-    mongo_config = MongoConfig()
-    storage_config = StorageConfig()
-    general_config = GeneralConfig()
-
-    # Exportar configurações como dicionários
-    DATABASE_CONFIG = database_config.to_dict()
-    MONGO_CONFIG = mongo_config.to_dict()
-    STORAGE_CONFIG = storage_config.to_dict()
-    GENERAL_CONFIG = general_config.to_dict()
-
+    carregar_configuracoes()
     logging.info("Configurações carregadas com sucesso.")
 except EnvironmentError as e:
     # Log de erro em caso de falha na configuração
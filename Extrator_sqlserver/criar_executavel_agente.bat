@@ -70,7 +70,6 @@ echo Gerando o executável com PyInstaller...
      --noconsole ^
     --add-data "config;config" ^
     --add-data "dicionarios_tipos.json;." ^
-    --add-data "main.py;." ^
     --hidden-import pymssql ^
     --hidden-import polars-lts-cpu ^
     --hidden-import aioboto3 ^
@@ -1,10 +1,15 @@
 import concurrent.futures
 import gc
+import queue
+import random
+import threading
 import time
+import uuid
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import List, Dict, Tuple, Set, Optional
-import pyarrow.parquet as pq
+from typing import Callable, List, Dict, Tuple, Set, Optional
+import pyarrow as pa
+import pyarrow.dataset as ds
 import logging
 import os
 import sys
@@ -18,10 +23,38 @@ from pymssql import OperationalError
 from pymysql import Connection
 from sqlalchemy import create_engine
 import pyodbc
+from urllib.parse import quote_plus
 from config import DATABASE_CONFIG, GENERAL_CONFIG, STORAGE_CONFIG
 from dicionario_dados import obter_dicionario_tipos, ajustar_tipos_dados
 from storage import enviar_resultados
 
+try:
+    # Leitura direta em Arrow (sem passar por pandas); opcional, com fallback para pd.read_sql
+    import connectorx as cx
+except ImportError:
+    cx = None
+
+TIMEZONE = pytz.timezone("America/Sao_Paulo")
+FORMATO_DATA_HORA = "%d/%m/%Y %H:%M:%S"
+
+# Falhas de conexão (pymssql, ODBC ou SQLAlchemy) que justificam reabrir a conexão e tentar de novo
+ERROS_CONEXAO = (OperationalError, pyodbc.OperationalError, sqlalchemy.exc.OperationalError)
+
+def eh_erro_conexao(erro: BaseException) -> bool:
+    """
+    Indica se o erro é uma falha de conexão (ERROS_CONEXAO). O pd.read_sql sobre uma conexão
+    DBAPI crua embrulha o erro do driver em pandas.errors.DatabaseError; nesse caso, a
+    classificação é feita pela causa original (__cause__).
+    """
+    if isinstance(erro, pd.errors.DatabaseError):
+        erro = erro.__cause__
+    return isinstance(erro, ERROS_CONEXAO)
+
+# Cache do driver ODBC detectado por servidor/banco: evita abrir uma conexão extra (e consultar
+# a versão do servidor) a cada conexão ou reconexão
+_driver_cache: Dict[Tuple[str, int, str, Optional[str]], str] = {}
+_lock_driver_cache = threading.Lock()
+
 
 def obter_versao_sqlserver(host: str, port: int, database: str, user: str, password: str) -> Optional[str]:
     """
@@ -90,6 +123,19 @@ def detectar_driver_sqlserver(host: str, port: int, database: str, user: str, pa
     Returns:
         Optional[str]: Nome do driver adequado ou None.
     """
+    chave = (host, port, database, driver_especifico)
+    with _lock_driver_cache:
+        if chave in _driver_cache:
+            return _driver_cache[chave]
+        driver = _detectar_driver_sqlserver(host, port, database, user, password, driver_especifico)
+        # Falhas não são guardadas, para que a próxima conexão tente detectar de novo
+        if driver:
+            _driver_cache[chave] = driver
+        return driver
+
+def _detectar_driver_sqlserver(host: str, port: int, database: str, user: str, password: str,
+                               driver_especifico: Optional[str] = None) -> Optional[str]:
+    """Detecção sem cache (ver detectar_driver_sqlserver)."""
     versao_banco = obter_versao_sqlserver(host, port, database, user, password)
     if versao_banco:
         try:
@@ -135,22 +181,97 @@ def detectar_driver_sqlserver(host: str, port: int, database: str, user: str, pa
             logging.error("Nenhum driver ODBC do SQL Server foi encontrado.")
             return None
 
+# Máximo de conexões ODBC ociosas mantidas no pool da MultiplexConnection
+TAMANHO_POOL_ODBC = min(32, 4 * (os.cpu_count() or 1))
+
+# ------------------------------------------------------------------------------
+# Cursor que devolve sua conexão ODBC ao pool da MultiplexConnection ao ser fechado.
 # ------------------------------------------------------------------------------
-# Classe wrapper que cria uma nova conexão para cada cursor via ODBC.
+class CursorDoPool:
+    def __init__(self, pool: "MultiplexConnection", conexao):
+        self._pool = pool
+        self._conexao = conexao
+        self._cursor = conexao.cursor()
+        self._falhou = False
+
+    def execute(self, *args, **kwargs):
+        try:
+            self._cursor.execute(*args, **kwargs)
+        except pyodbc.Error:
+            self._falhou = True
+            raise
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, nome):
+        return getattr(self._cursor, nome)
+
+    def close(self):
+        if self._conexao is None:
+            return
+        try:
+            self._cursor.close()
+        except pyodbc.Error:
+            self._falhou = True
+        self._pool._devolver(self._conexao, descartar=self._falhou)
+        self._conexao = None
+
+# ------------------------------------------------------------------------------
+# Classe wrapper que entrega uma conexão ODBC exclusiva para cada cursor via ODBC.
 # Essa abordagem garante que a conexão retorne um cursor iterável, compatível com pandas.
+# As conexões são reaproveitadas (pool LIFO) em vez de abertas a cada cursor, evitando
+# o handshake TCP/TLS/autenticação por consulta; as ociosas são validadas antes do uso.
 # ------------------------------------------------------------------------------
 class MultiplexConnection:
-    def __init__(self, dsn: str, autocommit: bool):
+    def __init__(self, dsn: str, autocommit: bool, tamanho_pool: int = TAMANHO_POOL_ODBC):
         self._dsn = dsn
         self._autocommit = autocommit
+        self._ociosas = queue.LifoQueue(maxsize=tamanho_pool)
+
+    def _obter(self):
+        # Reaproveita a conexão ociosa mais recente que ainda responder; senão abre uma nova
+        while True:
+            try:
+                conexao = self._ociosas.get_nowait()
+            except queue.Empty:
+                return pyodbc.connect(self._dsn, autocommit=self._autocommit)
+            try:
+                conexao.execute("SELECT 1").fetchall()
+                return conexao
+            except pyodbc.Error:
+                self._fechar(conexao)
+
+    def _devolver(self, conexao, descartar: bool = False):
+        if not descartar:
+            try:
+                if not self._autocommit:
+                    conexao.rollback()
+                self._ociosas.put_nowait(conexao)
+                return
+            except (pyodbc.Error, queue.Full):
+                pass
+        self._fechar(conexao)
+
+    @staticmethod
+    def _fechar(conexao):
+        try:
+            conexao.close()
+        except pyodbc.Error:
+            pass
 
     def cursor(self):
-        # Cria uma nova conexão ODBC a cada chamada de cursor() e retorna seu cursor.
-        return pyodbc.connect(self._dsn, autocommit=self._autocommit).cursor()
+        # Cada cursor usa uma conexão exclusiva do pool, devolvida quando o cursor é fechado.
+        return CursorDoPool(self, self._obter())
 
     def close(self):
-        # Como cada cursor abre sua própria conexão, não há conexão persistente para fechar.
-        pass
+        # Fecha as conexões ociosas; as que estiverem em uso são fechadas ao serem devolvidas.
+        while True:
+            try:
+                self._fechar(self._ociosas.get_nowait())
+            except queue.Empty:
+                break
 
     def commit(self):
         pass
@@ -210,6 +331,15 @@ def conectar_ao_banco(host: str, port: int, database: str, user: str, password:
         logging.error(f"Erro inesperado ao conectar ao banco de dados: {e}")
     return None
 
+def montar_url_arrow(host: str, port: int, database: str, user: str, password: str, **_) -> Optional[str]:
+    """
+    Monta a URL de conexão usada pelo connectorx para ler resultados direto em Arrow.
+    Retorna None se o connectorx não estiver instalado.
+    """
+    if cx is None:
+        return None
+    return f"mssql://{quote_plus(user)}:{quote_plus(password)}@{host}:{port}/{quote_plus(database)}"
+
 def fechar_conexao(conexao: Connection):
     """
     Fecha a conexão com o banco de dados.
@@ -225,18 +355,24 @@ def fechar_conexao(conexao: Connection):
 # ===================================================
 # EXECUÇÃO DE CONSULTAS
 # ===================================================
+# Máximo de consultas simultâneas no servidor, independentemente de "workers"
+LIMITE_THREADS_CONSULTAS = 8
+
 def executar_consultas(
     conexoes_config: dict,
     consultas: List[Dict[str, str]],
     pasta_temp: str,
     paralela: bool = False,
     workers: int = 4,
+    stop_event: Optional[threading.Event] = None,
 ) -> Tuple[Dict[str, str], Dict[str, Set[str]]]:
     """
     Executa as consultas no banco de dados de forma paralela ou sequencial.
 
     - Se paralela for False, uma única conexão é criada e reutilizada.
     - Se paralela for True, cada thread abre e fecha sua própria conexão.
+    - Com uma única thread de consulta, a leitura da próxima consulta se sobrepõe à gravação da anterior.
+    - Se stop_event for sinalizado, as consultas ainda não iniciadas são ignoradas.
 
     Retorna:
       - Um dicionário com o caminho final dos arquivos processados para cada consulta.
@@ -247,13 +383,71 @@ def executar_consultas(
     os.makedirs(pasta_temp, exist_ok=True)
 
     conexao_persistente = conectar_ao_banco(**conexoes_config)
+    url_arrow = montar_url_arrow(**conexoes_config)
+    # Cada execução volta a tentar a leitura em Arrow (a falha anterior pode ter sido passageira)
+    _urls_arrow_indisponiveis.discard(url_arrow)
+    conexoes_locais = threading.local()
+    conexoes_extras = []
+    lock_conexoes = threading.Lock()
+
+    def obter_conexao():
+        # A MultiplexConnection entrega uma conexão ODBC do pool por cursor e pode ser compartilhada;
+        # a conexão SQLAlchemy (fallback) não é thread-safe: uma por thread de trabalho
+        if not paralela or conexao_persistente is None or isinstance(conexao_persistente, MultiplexConnection):
+            return conexao_persistente
+        if not hasattr(conexoes_locais, "conexao"):
+            conexoes_locais.conexao = conectar_ao_banco(**conexoes_config)
+            with lock_conexoes:
+                conexoes_extras.append(conexoes_locais.conexao)
+        return conexoes_locais.conexao
+
+    def reabrir_conexao():
+        # Substitui a conexão quebrada (da thread ou a persistente) por uma nova; a
+        # MultiplexConnection é mantida (conexões com falha são descartadas do pool e as
+        # ociosas são validadas antes do reuso)
+        nonlocal conexao_persistente
+        atual = obter_conexao()
+        if isinstance(atual, MultiplexConnection):
+            return atual
+        if atual:
+            fechar_conexao(atual)
+        nova = conectar_ao_banco(**conexoes_config)
+        if hasattr(conexoes_locais, "conexao"):
+            conexoes_locais.conexao = nova
+            with lock_conexoes:
+                conexoes_extras.append(nova)
+        else:
+            conexao_persistente = nova
+        return nova
 
-    def processa_consulta(consulta: Dict[str, str]) -> Tuple[str, str, Set[str]]:
+    # Threads de consulta: não mais que as consultas, nem além do que o servidor e a CPU
+    # absorvem (o mesmo "workers" também dimensiona os envios, onde mais threads ajudam)
+    threads_consultas = max(1, min(workers, len(consultas), LIMITE_THREADS_CONSULTAS, 2 * (os.cpu_count() or 1)))
+    if paralela and threads_consultas < workers:
+        logging.info(f"Executando as consultas com {threads_consultas} threads (solicitadas: {workers}).")
+
+    # Faixas por consulta no connectorx (paralelismo em Rust, fora do GIL): no modo sequencial
+    # usa todos os workers; no paralelo divide-os entre as consultas simultâneas, evitando
+    # abrir workers x workers conexões no servidor
+    particoes_padrao = max(1, workers // threads_consultas) if paralela else workers
+
+    def opcoes_consulta(consulta: Dict[str, str]) -> Tuple[str, str, Optional[str], int]:
         nome_consulta = consulta.get("name", "").replace(" ", "")
-        query = consulta.get("query")
+        # Opcional por consulta: coluna numérica para dividir a leitura em faixas paralelas
+        return (nome_consulta, consulta.get("query"), consulta.get("partition_on"),
+                int(consulta.get("partition_num", particoes_padrao)))
+
+    def processa_consulta(consulta: Dict[str, str]) -> Tuple[str, str, Set[str]]:
+        nome_consulta, query, particionar_por, num_particoes = opcoes_consulta(consulta)
+        if stop_event is not None and stop_event.is_set():
+            logging.info(f"Consulta '{nome_consulta}' ignorada: parada solicitada.")
+            return nome_consulta, None, set()
         try:
             inicio = time.time()
-            pasta_consulta, particoes = executar_consulta(conexao_persistente, nome_consulta, query, pasta_temp)
+            pasta_consulta, particoes = executar_consulta(obter_conexao(), nome_consulta, query, pasta_temp,
+                                                          url_arrow=url_arrow, particionar_por=particionar_por,
+                                                          num_particoes=num_particoes,
+                                                          reabrir_conexao=reabrir_conexao)
             duracao = time.time() - inicio
             logging.info(f"Consulta '{nome_consulta}' processada em {duracao:.2f} segundos.")
             return nome_consulta, pasta_consulta, particoes
@@ -263,8 +457,11 @@ def executar_consultas(
 
 
     try:
-        if paralela:
-            with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Com várias threads, a leitura de uma consulta já se sobrepõe à gravação das outras; com
+        # uma só (workers=1 ou uma única consulta), o modo paralelo não teria essa sobreposição e
+        # segue pelo laço sequencial abaixo, que a faz explicitamente
+        if paralela and threads_consultas > 1:
+            with ThreadPoolExecutor(max_workers=threads_consultas, thread_name_prefix="extrator-consultas") as executor:
                 futuros = {executor.submit(processa_consulta, consulta): consulta for consulta in consultas}
                 for futuro in concurrent.futures.as_completed(futuros):
                     nome_consulta, pasta_consulta, particoes = futuro.result()
@@ -272,55 +469,229 @@ def executar_consultas(
                         resultados[nome_consulta] = pasta_consulta
                         particoes_criadas[nome_consulta] = particoes
         else:
-            for consulta in consultas:
-                nome_consulta, pasta_consulta, particoes = processa_consulta(consulta)
+            # Sequencial na conexão, mas com a gravação sobreposta: enquanto uma consulta é
+            # processada/gravada em segundo plano, a próxima já é lida. No máximo uma gravação
+            # fica pendente, limitando a memória a dois resultados.
+            def grava_consulta(nome_consulta: str, df: pl.DataFrame, inicio: float) -> Tuple[str, str, Set[str]]:
+                pasta_consulta, particoes = processar_dados(df, nome_consulta, pasta_temp)
+                logging.info(f"Consulta '{nome_consulta}' processada em {time.time() - inicio:.2f} segundos.")
+                return nome_consulta, pasta_consulta, particoes
+
+            def registra(futuro) -> None:
+                nome_consulta, pasta_consulta, particoes = futuro.result()
                 if pasta_consulta:
                     resultados[nome_consulta] = pasta_consulta
                     particoes_criadas[nome_consulta] = particoes
+
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="extrator-gravacao") as gravador:
+                pendente = None
+                for consulta in consultas:
+                    nome_consulta, query, particionar_por, num_particoes = opcoes_consulta(consulta)
+                    if stop_event is not None and stop_event.is_set():
+                        logging.info("Parada solicitada: as consultas restantes não serão executadas.")
+                        break
+                    inicio = time.time()
+                    df = ler_consulta(obter_conexao(), nome_consulta, query, url_arrow, particionar_por,
+                                      num_particoes, reabrir_conexao)
+                    if pendente:
+                        registra(pendente)
+                        pendente = None
+                    if df is not None:
+                        pendente = gravador.submit(grava_consulta, nome_consulta, df, inicio)
+                        del df
+                if pendente:
+                    registra(pendente)
     except Exception as e:
         logging.error(f"Erro na execução das consultas: {e}")
     finally:
         if conexao_persistente:
             fechar_conexao(conexao_persistente)
+        for conexao in conexoes_extras:
+            if conexao:
+                fechar_conexao(conexao)
 
     return resultados, particoes_criadas
 
-def executar_consulta(conexao, nome: str, query: str, pasta_temp: str) -> Tuple[str, Set[str]]:
+# URLs em que a leitura via connectorx falhou nesta execução (ex.: TLS/versão do servidor):
+# as consultas seguintes vão direto ao pd.read_sql, sem repetir a tentativa e o aviso
+_urls_arrow_indisponiveis: Set[str] = set()
+
+def ler_consulta_arrow(url_arrow: str, nome: str, query: str,
+                       particionar_por: Optional[str] = None, num_particoes: int = 1) -> Optional[pl.DataFrame]:
     """
-    Executa uma consulta SQL e retorna o caminho da pasta com os arquivos particionados e as partições criadas.
+    Lê o resultado da consulta direto em Arrow via connectorx e o envolve em Polars sem cópia.
+    Com particionar_por (coluna numérica), a consulta é dividida em num_particoes faixas lidas
+    em paralelo, cada uma em sua própria conexão.
+    Retorna None em caso de falha (ex.: TLS/versão do servidor), para o fallback via pandas;
+    após a primeira falha, a URL deixa de ser tentada até a próxima execução.
+    """
+    if url_arrow in _urls_arrow_indisponiveis:
+        return None
+    opcoes = {}
+    if particionar_por and num_particoes > 1:
+        opcoes = {"partition_on": particionar_por, "partition_num": num_particoes}
+    try:
+        return pl.from_arrow(cx.read_sql(url_arrow, query, return_type="arrow", **opcoes))
+    except Exception as e:
+        _urls_arrow_indisponiveis.add(url_arrow)
+        logging.warning(f"Leitura em Arrow indisponível para '{nome}' ({e}). Usando pd.read_sql "
+                        f"nas consultas restantes desta execução.")
+        return None
 
-    Se a consulta retornar um DataFrame vazio, retorna uma string vazia e um conjunto vazio.
+# Linhas por lote na leitura via pandas: só um lote fica em memória como DataFrame pandas
+TAMANHO_LOTE_LEITURA = 200_000
+
+def ler_consulta_em_lotes(conexao, query: str) -> pl.DataFrame:
+    """
+    Lê a consulta via pd.read_sql em lotes com colunas Arrow (dtype_backend="pyarrow"),
+    convertendo cada lote para uma tabela Arrow assim que é lido. As tabelas são unidas sem
+    cópia no final, de modo que o DataFrame pandas completo nunca é materializado.
+    """
+    partes = [
+        pa.Table.from_pandas(lote, preserve_index=False)
+        for lote in pd.read_sql(query, con=conexao, chunksize=TAMANHO_LOTE_LEITURA, dtype_backend="pyarrow")
+    ]
+    if not partes:
+        return pl.DataFrame()
+    # Lotes em que uma coluna veio toda nula têm tipo "null": promove para o tipo dos demais
+    return pl.from_arrow(pa.concat_tables(partes, promote_options="permissive"))
+
+def ler_consulta(conexao, nome: str, query: str,
+                 url_arrow: Optional[str] = None, particionar_por: Optional[str] = None,
+                 num_particoes: int = 1,
+                 reabrir_conexao: Optional[Callable[[], object]] = None) -> Optional[pl.DataFrame]:
+    """
+    Lê o resultado de uma consulta SQL em um DataFrame Polars.
+    Com url_arrow (connectorx instalado), o resultado vem direto em Arrow/Polars, sem o DataFrame pandas;
+    particionar_por/num_particoes dividem a leitura em faixas paralelas (ver ler_consulta_arrow).
+    Em falhas de conexão, aguarda com backoff exponencial e, se reabrir_conexao for informado,
+    repete a consulta em uma conexão nova.
+
+    Retorna None se a consulta vier vazia ou falhar.
     """
     retries = 5
     for tentativa in range(retries):
         try:
             logging.info(f"Executando consulta: {nome}...")
-            df_pandas = pd.read_sql(query, con=conexao)
-            if df_pandas.empty:
+            df = ler_consulta_arrow(url_arrow, nome, query, particionar_por, num_particoes) if url_arrow else None
+            if df is None:
+                df = ler_consulta_em_lotes(conexao, query)
+            if len(df) == 0:
                 logging.warning(f"Consulta '{nome}' retornou um DataFrame vazio.")
-                return "", set()
-            total_registros = len(df_pandas)
+                return None
+            total_registros = len(df)
             logging.info(f"Consulta '{nome}' finalizada. Total de registros: {total_registros}")
-            return processar_dados(df_pandas, nome, pasta_temp)
-        except OperationalError as e:
-            logging.warning(f"Erro de conexão na consulta '{nome}', tentativa {tentativa+1}/{retries}: {e}")
-            time.sleep(5)
+            return df
         except Exception as e:
-            logging.error(f"Erro ao executar a consulta '{nome}': {e}")
-            return "", set()
+            if not eh_erro_conexao(e):
+                logging.error(f"Erro ao executar a consulta '{nome}': {e}")
+                return None
+            logging.warning(f"Erro de conexão na consulta '{nome}', tentativa {tentativa+1}/{retries}: {e}")
+            if tentativa + 1 == retries:
+                break
+            time.sleep(min(60, 2 ** tentativa) + random.uniform(0, 1))
+            if reabrir_conexao:
+                try:
+                    conexao = reabrir_conexao()
+                except Exception as erro_conexao:
+                    logging.warning(f"Falha ao reabrir a conexão para a consulta '{nome}': {erro_conexao}")
     logging.error(f"Consulta '{nome}' falhou após {retries} tentativas.")
-    return "", set()
+    return None
+
+def executar_consulta(conexao, nome: str, query: str, pasta_temp: str,
+                      url_arrow: Optional[str] = None, particionar_por: Optional[str] = None,
+                      num_particoes: int = 1,
+                      reabrir_conexao: Optional[Callable[[], object]] = None) -> Tuple[str, Set[str]]:
+    """
+    Executa uma consulta SQL (ver ler_consulta) e retorna o caminho da pasta com os arquivos
+    particionados e as partições criadas.
+
+    Se a consulta retornar um DataFrame vazio, retorna uma string vazia e um conjunto vazio.
+    """
+    df = ler_consulta(conexao, nome, query, url_arrow, particionar_por, num_particoes, reabrir_conexao)
+    if df is None:
+        return "", set()
+    return processar_dados(df, nome, pasta_temp)
+
+# Hora (HH:MM:SS) dentro de textos como "1900-01-01 13:45:00" ou "13:45:00.0000000"
+PADRAO_HORA_VENDA = r"(\d{2}:\d{2}:\d{2})"
+
+def expressao_hora_venda(tipo: pl.DataType) -> pl.Expr:
+    """Expressão que converte HoraVenda (Time, Duration ou texto) para "HH:MM:SS"; nulos viram "00:00:00"."""
+    coluna = pl.col("HoraVenda")
+    if tipo == pl.Time:
+        hora = coluna.dt.strftime("%H:%M:%S")
+    elif isinstance(tipo, pl.Duration):
+        segundos = (coluna.dt.total_seconds() % 86400).cast(pl.Int64)
+        hora = pl.format(
+            "{}:{}:{}",
+            *[parte.cast(pl.Utf8).str.zfill(2) for parte in (segundos // 3600, segundos % 3600 // 60, segundos % 60)]
+        )
+    else:
+        # Texto (ou outro tipo representável como texto): extração vetorizada pelo regex do Polars
+        hora = coluna.cast(pl.Utf8).str.extract(PADRAO_HORA_VENDA, 1)
+    return hora.fill_null("00:00:00").alias("HoraVenda")
+
+def expressoes_particao_data(coluna_data: str, tipo_data: pl.DataType) -> List[pl.Expr]:
+    """Expressões de Ano/Mes (partições) a partir da coluna de data, que é gravada como texto."""
+    data = pl.col(coluna_data)
+    if tipo_data == pl.Date or isinstance(tipo_data, pl.Datetime):
+        # Data tipada: Ano/Mes saem dos campos inteiros da data, sem formatar nem fatiar texto
+        ano = data.dt.year().cast(pl.Utf8).str.zfill(4)
+        mes = data.dt.month().cast(pl.Utf8).str.zfill(2)
+    else:
+        ano, mes = data.cast(pl.Utf8).str.slice(0, 4), data.cast(pl.Utf8).str.slice(5, 2)
+    return [ano.alias("Ano"), mes.alias("Mes"), data.cast(pl.Utf8)]
+
+# zstd nível 3: arquivos menores que snappy (menos bytes no upload) com leitura tão rápida quanto
+COMPRESSAO_PARQUET = "zstd"
+NIVEL_COMPRESSAO_PARQUET = 3
+
+# Alvo de tamanho (em memória) de cada row group e limites de linhas por row group
+BYTES_ROW_GROUP_ALVO = 128 * 1024 * 1024
+LINHAS_ROW_GROUP_MIN = 50_000
+LINHAS_ROW_GROUP_MAX = 2_000_000
+
+def calcular_row_group(df_polars: pl.DataFrame) -> int:
+    """Linhas por row group para que cada um tenha ~128 MiB, conforme a largura média das linhas."""
+    bytes_por_linha = max(1.0, df_polars.estimated_size() / max(1, df_polars.height))
+    return int(max(LINHAS_ROW_GROUP_MIN, min(LINHAS_ROW_GROUP_MAX, BYTES_ROW_GROUP_ALVO / bytes_por_linha)))
 
-def processar_dados(df_pandas: pd.DataFrame, nome: str, pasta_temp: str) -> Tuple[str, Set[str]]:
+def gravar_particionado(df_polars: pl.DataFrame, pasta_consulta: str, partition_cols: List[str]) -> None:
     """
-    Processes a pandas DataFrame by applying transformations, converting it to a Polars DataFrame,
+    Grava o DataFrame em Parquet particionado (hive) via pyarrow.dataset. As colunas de partição
+    ficam apenas nos diretórios (idEmpresa=/Ano=/Mes=), fora dos arquivos, como no layout
+    publicado desde o write_to_dataset; o escritor particionado do Polars as mantém dentro de
+    cada arquivo, e por isso não é usado.
+    O tamanho do row group é calculado a partir da largura das linhas (calcular_row_group).
+    """
+    row_group = calcular_row_group(df_polars)
+    ds.write_dataset(
+        df_polars.to_arrow(),
+        base_dir=pasta_consulta,
+        format="parquet",
+        partitioning=partition_cols,
+        partitioning_flavor="hive",
+        file_options=ds.ParquetFileFormat().make_write_options(
+            compression=COMPRESSAO_PARQUET, compression_level=NIVEL_COMPRESSAO_PARQUET, use_dictionary=True
+        ),
+        max_rows_per_group=row_group,
+        # Nome único por execução, como no write_to_dataset
+        basename_template=f"{uuid.uuid4().hex}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        use_threads=True
+    )
+
+def processar_dados(df_pandas, nome: str, pasta_temp: str) -> Tuple[str, Set[str]]:
+    """
+    Processes a pandas (or Polars, when read via Arrow) DataFrame by applying transformations, converting it to a Polars DataFrame,
     and saving the data in a partitioned Parquet format. Additionally, it handles specific adjustments
     based on the data context (e.g., sales or purchases) and ensures certain columns are correctly
     formatted or present. The function creates a temporary directory for saving files and logs
     information about the process flow.
 
     Parameters:
-        df_pandas (pd.DataFrame): Input pandas DataFrame to be processed.
+        df_pandas (pd.DataFrame | pl.DataFrame): Input DataFrame to be processed.
         nome (str): Name of the dataset, used for context-specific column handling.
         pasta_temp (str): Path to the temporary folder where files will be saved.
 
@@ -332,7 +703,7 @@ def processar_dados(df_pandas: pd.DataFrame, nome: str, pasta_temp: str) -> Tupl
         ValueError: If the required 'idEmpresa' column is missing from the processed Polars DataFrame.
     """
     try:
-        os.makedirs(pasta_temp, exist_ok=True)
+        # pasta_temp já é criada em executar_consultas; os escritores criam os diretórios das partições
         pasta_consulta = os.path.join(pasta_temp, nome)
         logging.info(f"Processando dados da consulta '{nome}'...")
         coluna_data = None
@@ -341,25 +712,28 @@ def processar_dados(df_pandas: pd.DataFrame, nome: str, pasta_temp: str) -> Tupl
         elif nome == "Compras" and "DataEmissaoNF" in df_pandas.columns:
             coluna_data = "DataEmissaoNF"
 
-        if "HoraVenda" in df_pandas.columns:
-            if pd.api.types.is_timedelta64_dtype(df_pandas["HoraVenda"]):
-                df_pandas["HoraVenda"] = df_pandas["HoraVenda"].apply(lambda x: str(x).split()[-1] if not pd.isna(x) else "00:00:00")
-            elif df_pandas["HoraVenda"].dtype == "object":
-                df_pandas["HoraVenda"] = df_pandas["HoraVenda"].astype(str).str.extract(r"(\d{2}:\d{2}:\d{2})")[0].fillna("00:00:00")
-
-        # Conversão para Polars – utilizando a função from_pandas (ou from_arrow se for vantajoso)
-        df_polars = pl.from_pandas(df_pandas).with_columns([
-            pl.lit(datetime.now(pytz.timezone("America/Sao_Paulo")).strftime("%d/%m/%Y %H:%M:%S")).alias("DataHoraAtualizacao"),
-            pl.lit(STORAGE_CONFIG["idemp"]).alias("idEmpresa"),
-            pl.lit(STORAGE_CONFIG["idemp"]).alias("idEmp")
-        ])
-
+        # Conversão para Polars: via Arrow já é Polars; no caminho pandas as colunas são Arrow
+        # (dtype_backend="pyarrow") e passam por uma única tabela Arrow, sem reempacotar valores
+        if isinstance(df_pandas, pl.DataFrame):
+            df_base = df_pandas
+        else:
+            df_base = pl.from_arrow(pa.Table.from_pandas(df_pandas, preserve_index=False))
+        # Libera a referência local ao DataFrame de entrada assim que o Polars assume os dados
+        del df_pandas
+        # HoraVenda, enriquecimento e chaves de partição num único plano lazy (uma passada, sem
+        # DataFrames intermediários); as expressões são independentes entre si
+        id_empresa = pl.lit(STORAGE_CONFIG["idemp"])
+        expressoes = [
+            pl.lit(datetime.now(TIMEZONE).strftime(FORMATO_DATA_HORA)).alias("DataHoraAtualizacao"),
+            id_empresa.alias("idEmpresa"),
+            id_empresa.alias("idEmp")
+        ]
+        if "HoraVenda" in df_base.columns:
+            expressoes.append(expressao_hora_venda(df_base.schema["HoraVenda"]))
         if coluna_data:
-            df_polars = df_polars.with_columns(pl.col(coluna_data).cast(pl.Utf8))
-            df_polars = df_polars.with_columns([
-                pl.col(coluna_data).str.slice(0, 4).alias("Ano"),
-                pl.col(coluna_data).str.slice(5, 2).alias("Mes")
-            ])
+            expressoes.extend(expressoes_particao_data(coluna_data, df_base.schema[coluna_data]))
+        df_polars = df_base.lazy().with_columns(expressoes).collect()
+        del df_base
          #   amostra_particoes = df_polars.select(["Ano", "Mes", "Dia"]).unique().head(5)
          #   logging.info(f"Amostra das partições para '{nome}':\n{amostra_particoes.to_pandas().to_string(index=False)}")
 
@@ -369,17 +743,16 @@ def processar_dados(df_pandas: pd.DataFrame, nome: str, pasta_temp: str) -> Tupl
 
         logging.info(f"Salvando '{nome}' em formato particionado...")
         partition_cols = ["idEmpresa"] + (["Ano", "Mes"] if coluna_data else [])
-        pq.write_to_dataset(
-            df_polars.to_arrow(),
-            root_path=pasta_consulta,
-            partition_cols=partition_cols,
-            compression="snappy",
-            use_dictionary=True,
-            row_group_size=500_000
-        )
+        gravar_particionado(df_polars, pasta_consulta, partition_cols)
         logging.info(f"Salvamento concluído para '{nome}'. Arquivos disponíveis em: {pasta_consulta}")
 
-        particoes_criadas = {os.path.join(pasta_consulta, d) for d in os.listdir(pasta_consulta)}
+        # Diretórios de primeiro nível criados pela escrita (hive), a partir dos valores já conhecidos,
+        # sem reler a pasta
+        coluna_raiz = partition_cols[0]
+        particoes_criadas = {
+            os.path.join(pasta_consulta, f"{coluna_raiz}={valor}")
+            for valor in df_polars.get_column(coluna_raiz).unique().to_list()
+        }
         return pasta_consulta, particoes_criadas
 
     except Exception as e:
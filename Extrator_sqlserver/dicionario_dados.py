@@ -3,7 +3,6 @@ import logging
 import os
 import sys
 
-import pandas as pd
 import polars as pl
 
 
@@ -103,22 +102,33 @@ def ajustar_tipos_dados(dataframe: pl.DataFrame, nome_consulta: str, log_adjust:
         }
         _tipo_cache[nome_consulta] = (dicionario, tipo_polars)
 
+    expressoes = {}
+    # Snapshot do schema: consultado uma vez, em vez de a cada coluna
+    schema = dict(dataframe.schema)
+
     # Conversão automática de float64 para int64 se todos os valores forem inteiros
-    for coluna in dataframe.schema:
-        if dataframe.schema[coluna] == pl.Float64:
-            try:
-                # Utiliza Pandas para verificar se todos os valores são inteiros (após remover nulos)
-                if dataframe[coluna].drop_nulls().to_pandas().apply(lambda x: float(x).is_integer() if not pd.isna(x) else False).all():
-                    dataframe = dataframe.with_columns(pl.col(coluna).cast(pl.Int64))
-                    if log_adjust:
-                        logging.info(f"Coluna '{coluna}' convertida de float64 para int64 automaticamente.")
-            except Exception as e:
+    colunas_float = [coluna for coluna, tipo in schema.items() if tipo == pl.Float64]
+    if colunas_float:
+        try:
+            # Verificação vetorizada no Polars, todas as colunas numa única passada (nulos são
+            # ignorados; NaN e infinito não são inteiros)
+            inteiras = dataframe.select([
+                ((pl.col(coluna) == pl.col(coluna).floor()) & pl.col(coluna).is_finite()).all().alias(coluna)
+                for coluna in colunas_float
+            ]).row(0)
+        except Exception as e:
+            inteiras = [False] * len(colunas_float)
+            if log_adjust:
+                logging.error(f"Erro ao verificar conversão automática das colunas {colunas_float}: {e}")
+        for coluna, inteira in zip(colunas_float, inteiras):
+            if inteira:
+                expressoes[coluna] = pl.col(coluna).cast(pl.Int64)
                 if log_adjust:
-                    logging.error(f"Erro ao verificar conversão automática da coluna '{coluna}': {e}")
+                    logging.info(f"Coluna '{coluna}' convertida de float64 para int64 automaticamente.")
 
-    # Ajuste dos tipos conforme o dicionário
+    # Ajuste dos tipos conforme o dicionário (sobre a conversão automática, se houver)
     for coluna, tipo in dicionario.items():
-        if coluna not in dataframe.schema:
+        if coluna not in schema:
             if log_adjust:
                 logging.warning(f"Coluna '{coluna}' ausente. Adicionando com valor padrão.")
             valor_padrao = {
@@ -128,17 +138,25 @@ def ajustar_tipos_dados(dataframe: pl.DataFrame, nome_consulta: str, log_adjust:
                 "date": "1970-01-01",
                 "timestamp": "1970-01-01T00:00:00.000"
             }.get(tipo, "")
-            dataframe = dataframe.with_columns(
-                pl.lit(valor_padrao).cast(tipo_polars.get(tipo, pl.Utf8)).alias(coluna)
-            )
+            expressoes[coluna] = pl.lit(valor_padrao).cast(tipo_polars.get(tipo, pl.Utf8)).alias(coluna)
+        elif tipo not in tipo_polars:
+            if log_adjust:
+                logging.error(f"Erro ao ajustar a coluna '{coluna}' para o tipo '{tipo}': tipo desconhecido")
         else:
-            try:
-                dataframe = dataframe.with_columns(
-                    pl.col(coluna).cast(tipo_polars[tipo])
-                )
-            except Exception as e:
-                if log_adjust:
-                    logging.error(f"Erro ao ajustar a coluna '{coluna}' para o tipo '{tipo}': {e}")
+            expressoes[coluna] = expressoes.get(coluna, pl.col(coluna)).cast(tipo_polars[tipo])
+
+    # Todas as conversões e colunas padrão numa única projeção; se alguma conversão falhar,
+    # aplica coluna a coluna para manter as demais e registrar a que falhou
+    if expressoes:
+        try:
+            dataframe = dataframe.with_columns(list(expressoes.values()))
+        except Exception:
+            for coluna, expressao in expressoes.items():
+                try:
+                    dataframe = dataframe.with_columns(expressao)
+                except Exception as e:
+                    if log_adjust:
+                        logging.error(f"Erro ao ajustar a coluna '{coluna}' para o tipo '{dicionario.get(coluna, 'int64')}': {e}")
 
     if log_adjust:
         logging.info(f"[Consulta: {nome_consulta}] Tipos ajustados com sucesso.")
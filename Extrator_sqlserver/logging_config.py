@@ -1,14 +1,91 @@
+import atexit
 import logging
 import os
+import queue
 import sys
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from rich.logging import RichHandler
-from rich.console import Console
+from rich.console import Console, Group
 from rich.panel import Panel
 from rich.traceback import install as rich_traceback
 
-# Instalação do rastreamento detalhado de erros com Rich
-rich_traceback(show_locals=True)
+
+class QueueHandlerLocal(QueueHandler):
+    """
+    QueueHandler para um listener no mesmo processo: enfileira o próprio registro, sem
+    pré-formatar nem descartar exc_info, para que o RichHandler ainda exiba tracebacks detalhados.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class ArquivoLogRotativo(RotatingFileHandler):
+    """
+    RotatingFileHandler que formata cada registro uma única vez: o emit padrão formata no
+    shouldRollover (para medir o tamanho) e de novo ao gravar. A rotação é decidida pelo
+    tamanho do arquivo mantido em memória (lido com tell() só ao abrir o arquivo, já que
+    tell() descarrega o buffer), sem os os.path.exists/isfile que o shouldRollover padrão
+    faz a cada registro; essa verificação só é feita quando o limite seria ultrapassado.
+
+    Também não descarrega o arquivo a cada registro: os registros se acumulam no buffer do
+    arquivo e são gravados juntos quando a fila de logs esvazia (ListenerLogs) ou, para
+    erros, imediatamente.
+    """
+
+    # Caracteres já gravados no arquivo atual (atualizado a cada escrita e ao reabrir)
+    tamanho_arquivo = 0
+
+    def _open(self):
+        stream = super()._open()
+        self.tamanho_arquivo = stream.tell()
+        return stream
+
+    def emit(self, record):
+        try:
+            msg = self.format(record) + self.terminator
+            if self.stream is None:
+                self.stream = self._open()
+            if self.ultrapassa_limite(len(msg)):
+                self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+            self.stream.write(msg)
+            self.tamanho_arquivo += len(msg)
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+        if record.levelno >= logging.ERROR:
+            self.descarregar()
+
+    def ultrapassa_limite(self, tamanho):
+        """Indica se gravar `tamanho` caracteres levaria o arquivo ao limite de rotação."""
+        if self.maxBytes <= 0 or self.tamanho_arquivo + tamanho < self.maxBytes:
+            return False
+        # Como no shouldRollover padrão: arquivos especiais (ex.: /dev/null) nunca rotacionam
+        return not (os.path.exists(self.baseFilename) and not os.path.isfile(self.baseFilename))
+
+    def flush(self):
+        # Chamado pelo StreamHandler a cada registro; o descarregamento fica em descarregar()
+        pass
+
+    def descarregar(self):
+        """Grava no disco os registros acumulados no buffer do arquivo."""
+        super().flush()
+
+
+class ListenerLogs(QueueListener):
+    """
+    QueueListener que descarrega os handlers quando a fila esvazia, agrupando numa única
+    escrita os registros que chegaram em rajada.
+    """
+
+    def dequeue(self, block):
+        if block and self.queue.empty():
+            for handler in self.handlers:
+                getattr(handler, "descarregar", handler.flush)()
+        return self.queue.get(block)
 
 
 class LoggingConfigurator:
@@ -17,6 +94,11 @@ class LoggingConfigurator:
     Fornece logs detalhados no console e arquivos rotativos para histórico.
     """
 
+    # Listener em uso pelo logger raiz (uma reconfiguração substitui o anterior) e a
+    # configuração (arquivo, nível) que ele atende
+    _listener_ativo = None
+    _configuracao_ativa = None
+
     def __init__(self, base_log_dir="logs", log_level=logging.INFO):
         """
         Inicializa a configuração de logging.
@@ -28,35 +110,61 @@ class LoggingConfigurator:
         self.console = Console()
         self.log_level = log_level
         self.log_format = "%(message)s"
+        self.console_log_format = "[%(asctime)s] %(levelname)-8s %(message)s"
         self.file_log_format = "%(asctime)s - %(levelname)-8s - [%(filename)s:%(lineno)d] %(message)s"
         self.is_frozen = getattr(sys, 'frozen', False)  # Detecta se está empacotado com PyInstaller
 
+        # Rastreamento detalhado de erros com Rich; as variáveis locais de cada frame (que podem
+        # ser DataFrames ou documentos grandes) só são exibidas com LOG_TRACEBACK_LOCAIS=1
+        rich_traceback(show_locals=os.getenv("LOG_TRACEBACK_LOCAIS") == "1", max_frames=20)
+
+        if self.is_frozen:
+            # Nenhum formato usa thread/processo/tarefa: evita coletá-los em cada registro; e,
+            # no executável, falhas de um handler não devem imprimir tracebacks no console
+            logging.logThreads = False
+            logging.logProcesses = False
+            logging.logMultiprocessing = False
+            logging.logAsyncioTasks = False
+            logging.raiseExceptions = False
+
         # Determina o diretório de logs correto
         self.base_log_dir = base_log_dir if not self.is_frozen else os.path.dirname(sys.executable)
         os.makedirs(self.base_log_dir, exist_ok=True)
+        self.listener = None
 
     def _get_log_filepath(self, filename):
         """Retorna o caminho completo do arquivo de log."""
         return os.path.join(self.base_log_dir, filename)
 
-    def _configurar_arquivo_log(self, logger):
+    def _configurar_arquivo_log(self, handlers):
         """
         Configura um arquivo de log rotativo para armazenar logs persistentes.
         """
         log_file_path = self._get_log_filepath("registro.log")
-        file_handler = RotatingFileHandler(
+        file_handler = ArquivoLogRotativo(
             log_file_path,
             maxBytes=10 * 1024 * 1024,  # 10 MB antes de girar o log
             backupCount=5  # Mantém até 5 logs antigos
         )
         file_handler.setLevel(self.log_level)
         file_handler.setFormatter(logging.Formatter(self.file_log_format))
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
 
-    def _configurar_console_log(self, logger):
+    def _configurar_console_log(self, handlers):
         """
-        Configura a saída de log para o console usando Rich.
+        Configura a saída de log para o console: registros abaixo de WARNING vão por um
+        StreamHandler simples (sem o custo de renderização do Rich a cada linha) e avisos
+        e erros pelo Rich.
         """
+        nivel_rich = self.log_level
+        if sys.stdout is not None:  # Executável sem console não tem stdout
+            plain_handler = logging.StreamHandler(sys.stdout)
+            plain_handler.setLevel(self.log_level)
+            plain_handler.addFilter(lambda record: record.levelno < logging.WARNING)
+            plain_handler.setFormatter(logging.Formatter(self.console_log_format, datefmt="%d/%m/%Y %H:%M:%S"))
+            handlers.append(plain_handler)
+            nivel_rich = max(self.log_level, logging.WARNING)
+
         console_handler = RichHandler(
             console=self.console,
             rich_tracebacks=True,  # Exibir rastreamentos bonitos
@@ -64,9 +172,9 @@ class LoggingConfigurator:
             show_level=True,       # Mostrar níveis de log
             show_path=False        # Não mostrar caminho do arquivo no console
         )
-        console_handler.setLevel(self.log_level)
+        console_handler.setLevel(nivel_rich)
         console_handler.setFormatter(logging.Formatter(self.log_format))
-        logger.addHandler(console_handler)
+        handlers.append(console_handler)
 
     def configurar_logging(self):
         """
@@ -75,21 +183,57 @@ class LoggingConfigurator:
         logger = logging.getLogger()
         logger.setLevel(self.log_level)
 
+        # Já configurado para o mesmo arquivo e nível (ex.: main executado de novo pelo agente):
+        # reaproveita os handlers em vez de recriá-los
+        configuracao = (os.path.abspath(self._get_log_filepath("registro.log")), self.log_level)
+        if LoggingConfigurator._listener_ativo is not None and LoggingConfigurator._configuracao_ativa == configuracao:
+            self.listener = LoggingConfigurator._listener_ativo
+            return
+
         if logger.hasHandlers():
             logger.handlers.clear()  # Limpa manipuladores antigos
-
-        # Configuração de log para arquivo e console
-        self._configurar_arquivo_log(logger)
-        self._configurar_console_log(logger)
+        LoggingConfigurator._encerrar_listener_ativo()
+
+        # Arquivo e console são escritos por uma thread própria (QueueListener): quem registra
+        # só enfileira, sem esperar pelo disco nem pela formatação do Rich
+        handlers = []
+        self._configurar_arquivo_log(handlers)
+        self._configurar_console_log(handlers)
+        fila_logs = queue.Queue(-1)
+        self.listener = ListenerLogs(fila_logs, *handlers, respect_handler_level=True)
+        self.listener.start()
+        LoggingConfigurator._listener_ativo = self.listener
+        LoggingConfigurator._configuracao_ativa = configuracao
+        logger.addHandler(QueueHandlerLocal(fila_logs))
 
         # Determina o modo de execução
         modo_execucao = "empacotado (PyInstaller)" if self.is_frozen else "local"
-        self.console.print(Panel(f"[bold cyan]Modo de execução: {modo_execucao}[/bold cyan]"))
-
-        # Mensagem inicial estilizada
-        self.console.print(Panel("[bold green] Sistema de logging configurado com sucesso![/bold green]"))
+        # Banner do modo de execução e mensagem inicial estilizada, numa única renderização
+        self.console.print(Group(
+            Panel(f"[bold cyan]Modo de execução: {modo_execucao}[/bold cyan]"),
+            Panel("[bold green] Sistema de logging configurado com sucesso![/bold green]")
+        ))
         logging.info(f" Sistema iniciado no modo: {modo_execucao}")
 
+    def encerrar(self):
+        """
+        Descarrega os registros pendentes na fila e encerra a thread de escrita dos logs.
+        """
+        if self.listener is LoggingConfigurator._listener_ativo:
+            LoggingConfigurator._encerrar_listener_ativo()
+
+    @classmethod
+    def _encerrar_listener_ativo(cls):
+        listener, cls._listener_ativo, cls._configuracao_ativa = cls._listener_ativo, None, None
+        if listener is not None:
+            listener.stop()
+            for handler in listener.handlers:
+                handler.close()
+
+
+# Garante que os registros ainda na fila sejam gravados ao encerrar o processo
+atexit.register(LoggingConfigurator._encerrar_listener_ativo)
+
 
 # Exemplo de uso
 if __name__ == "__main__":
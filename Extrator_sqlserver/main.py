@@ -4,24 +4,24 @@ import shutil
 import sys
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 import polars as pl
-import pyarrow.parquet as pq
-import pytz
 
 from config import (
-    MONGO_CONFIG, STORAGE_CONFIG, configurar_destino_parametros,
+    MONGO_CONFIG, STORAGE_CONFIG, carregar_configuracoes, configurar_destino_parametros,
     configurar_conexao_banco, configurar_parametro_workers
 )
-from database import executar_consultas
+from database import (
+    executar_consultas, COMPRESSAO_PARQUET, NIVEL_COMPRESSAO_PARQUET, TIMEZONE, FORMATO_DATA_HORA
+)
 from dicionario_dados import ajustar_tipos_dados
 from logging_config import LoggingConfigurator
 from mongo import MongoDBConnector
 from storage import enviar_resultados
 
 import asyncio
-import sys
 
 if sys.platform == "win32":
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
@@ -29,11 +29,6 @@ if sys.platform == "win32":
 # Variável global para controle do sistema
 sistema_executando = True
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
 
 def enviar_tabela_atualizacao(portal, destino_tipo, destino_config, consultas_status, workers, inicio_processo):
     """
@@ -50,7 +45,8 @@ def enviar_tabela_atualizacao(portal, destino_tipo, destino_config, consultas_st
     """
     try:
         # 🔹 Verificar se TODAS as consultas foram bem-sucedidas
-        if not consultas_status or not all(consultas_status.values()) or len(consultas_status) < 8:
+        # (verificações mais baratas primeiro; nada é montado se alguma falhar)
+        if not consultas_status or len(consultas_status) < 8 or not all(consultas_status.values()):
             logging.info(
                 "A tabela de atualização NÃO será enviada, pois nem todas as consultas foram processadas com sucesso.\n"
                 "ou a opção de consulta unica foi selecionada."
@@ -59,24 +55,28 @@ def enviar_tabela_atualizacao(portal, destino_tipo, destino_config, consultas_st
 
         logging.info("Criando tabela de atualização...")
 
+        idemp = STORAGE_CONFIG["idemp"]
         df_atualizacao = pl.DataFrame({
             "DataHoraAtualizacao": [inicio_processo],
-            "idEmp": [STORAGE_CONFIG["idemp"]],
-            "idEmpresa": [STORAGE_CONFIG["idemp"]]
+            "idEmp": [idemp],
+            "idEmpresa": [idemp]
         })
 
         # 🔹 Ajustar tipos de dados antes de salvar
         df_atualizacao = ajustar_tipos_dados(df_atualizacao, "Atualizacao")
 
-        # 🔹 Criar diretório temporário para salvar a tabela de atualização
+        # 🔹 Diretório temporário da tabela de atualização (criado junto com a partição)
         temp_dir = os.path.join("temp", "Atualizacao")
-        os.makedirs(temp_dir, exist_ok=True)
 
         # 🔹 Salvar a tabela de atualização no formato Parquet
-        pq.write_to_dataset(
-            df_atualizacao.to_arrow(),
-            root_path=temp_dir,
-            partition_cols=['idEmpresa']
+        # Uma única linha: grava direto o arquivo da partição idEmpresa=<id> (layout hive, sem a
+        # coluna de partição no arquivo), sem passar pelo escritor particionado
+        pasta_particao = os.path.join(temp_dir, f"idEmpresa={idemp}")
+        os.makedirs(pasta_particao, exist_ok=True)
+        df_atualizacao.drop("idEmpresa").write_parquet(
+            os.path.join(pasta_particao, "part-0.parquet"),
+            compression=COMPRESSAO_PARQUET,
+            compression_level=NIVEL_COMPRESSAO_PARQUET
         )
 
         logging.info("Tabela de atualização criada. Iniciando envio...")
@@ -94,23 +94,75 @@ def enviar_tabela_atualizacao(portal, destino_tipo, destino_config, consultas_st
         logging.error(f"Erro ao enviar tabela de atualização: {e}")
 
 
-def main():
+def remover_diretorio(caminho: str, workers: int = 8) -> bool:
+    """
+    Remove um diretório e todo o seu conteúdo, apagando os arquivos em paralelo (muitos arquivos
+    Parquet pequenos, onde a remoção é limitada pela latência de metadados e não pela CPU).
+    Em caso de falha, recorre ao shutil.rmtree.
+
+    Args:
+        caminho (str): Diretório a ser removido.
+        workers (int): Número de threads para apagar os arquivos.
+
+    Returns:
+        bool: False se o diretório não existia (sem um os.path.exists separado); True caso contrário.
+    """
+    try:
+        arquivos, diretorios = [], []
+        # os.walk não produz nada para um diretório inexistente
+        encontrado = False
+        for raiz, subdirs, nomes in os.walk(caminho, topdown=False):
+            encontrado = True
+            arquivos.extend(os.path.join(raiz, nome) for nome in nomes)
+            diretorios.extend(os.path.join(raiz, subdir) for subdir in subdirs)
+        if not encontrado:
+            return False
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="extrator-limpeza") as executor:
+            list(executor.map(os.unlink, arquivos))
+        # os.walk(topdown=False) lista os subdiretórios antes dos diretórios que os contêm
+        for diretorio in diretorios:
+            os.rmdir(diretorio)
+        os.rmdir(caminho)
+    except OSError as e:
+        logging.warning(f"Falha ao remover '{caminho}' em paralelo ({e}). Removendo com shutil.rmtree.")
+        shutil.rmtree(caminho, ignore_errors=True)
+    return True
+
+
+def parada_solicitada(stop_event) -> bool:
+    """Indica se o agente solicitou a parada da execução em andamento."""
+    if stop_event is not None and stop_event.is_set():
+        logging.warning("Parada solicitada pelo agente. Interrompendo a execução.")
+        return True
+    return False
+
+
+def main(stop_event=None, configurar_log=True):
     """
     Função principal que orquestra o fluxo de execução do sistema.
+
+    Args:
+        stop_event (threading.Event, opcional): Evento sinalizado pelo agente para interromper
+            a execução entre as etapas (consultas ainda não iniciadas, envios e tabela de atualização).
+        configurar_log (bool): Se False, mantém a configuração de logging do processo (execução
+            dentro do agente, cujo logger raiz não deve ser redirecionado ao log do extrator).
     """
 
     global sistema_executando
 
     try:
-        configurador = LoggingConfigurator()
-        configurador.configurar_logging()
+        if configurar_log:
+            configurador = LoggingConfigurator()
+            configurador.configurar_logging()
 
-        timezone = pytz.timezone("America/Sao_Paulo")
-        inicio_processo = datetime.now(timezone).strftime("%d/%m/%Y %H:%M:%S")
+        inicio_processo = datetime.now(TIMEZONE).strftime(FORMATO_DATA_HORA)
         logging.info(f"Sistema iniciado às {inicio_processo}")
 
-        if os.path.exists("temp"):
-            shutil.rmtree("temp")
+        # Relê o config/config.env a cada execução: dentro do agente o processo é longo e o
+        # módulo config só é importado uma vez
+        carregar_configuracoes(recarregar_env=True)
+
+        if remover_diretorio("temp"):
             logging.info("Diretório temporário removido.")
 
         # Conectar ao MongoDB
@@ -148,30 +200,37 @@ def main():
 
         logging.info(f"Executando com {workers} threads.")
 
-        consultas = parametros_mongo_empresa.get("parametrizacaoIntegracao", {}).get("consultas", [])
-        if not consultas:
+        todas_consultas = parametros_mongo_empresa.get("parametrizacaoIntegracao", {}).get("consultas", []) or []
+        if not todas_consultas:
             logging.error("Nenhuma consulta configurada.")
             return
 
+        consultas = todas_consultas
         consulta_desejada = ""  # Defina um nome para filtrar uma consulta específica
         if consulta_desejada:
-            consultas = [c for c in consultas if c.get("name") == consulta_desejada]
+            consultas = [c for c in todas_consultas if c.get("name") == consulta_desejada]
             if not consultas:
                 logging.warning(f"Consulta '{consulta_desejada}' não encontrada. Executando todas as consultas.")
-                consultas = parametros_mongo_empresa.get("parametrizacaoIntegracao", {}).get("consultas", [])
+                consultas = todas_consultas
 
         if not consultas:
             logging.error("Nenhuma consulta válida encontrada.")
             return
 
+        # Criada por executar_consultas
         pasta_temp = "temp"
-        os.makedirs(pasta_temp, exist_ok=True)
+
+        if parada_solicitada(stop_event):
+            return
 
         # Executar consultas e obter as pastas com os dados processados
         pastas_resultados, particoes_utilizadas = executar_consultas(
-            conexoes_config, consultas, pasta_temp, paralela=True, workers=workers
+            conexoes_config, consultas, pasta_temp, paralela=True, workers=workers, stop_event=stop_event
         )
 
+        if parada_solicitada(stop_event):
+            return
+
         # Remover espaços dos nomes das consultas para evitar problemas na manipulação
         pastas_resultados = {
             nome.replace(" ", ""): caminho
@@ -191,24 +250,47 @@ def main():
         # Dicionário para armazenar o status do envio das consultas
         consultas_status = {}
 
-        for nome_consulta, pasta_consulta in pastas_resultados.items():
-            try:
-                logging.info(f"Iniciando envio da consulta '{nome_consulta}'...")
-
-                sucesso = enviar_resultados(
-                    pasta_consulta, portal, destino_tipo, destino_config, workers,nome_consulta
-                )
-
-                consultas_status[nome_consulta] = sucesso
-
-                if sucesso:
-                    logging.info(f"Consulta '{nome_consulta}' enviada com sucesso.")
-                else:
-                    logging.error(f"Falha no envio da consulta '{nome_consulta}'.")
+        # Envios das consultas em paralelo (a latência de uma não segura as demais), dividindo
+        # entre elas os workers e o limite de uploads em voo de cada destino, para que o total
+        # de conexões simultâneas continue ~workers e o de uploads no limite do destino
+        envios_simultaneos = max(1, min(len(pastas_resultados), workers))
+        workers_envio = max(1, workers // envios_simultaneos)
+
+        def envia_consulta(nome_consulta, pasta_consulta):
+            # Parada solicitada: envios ainda não iniciados não começam
+            if stop_event is not None and stop_event.is_set():
+                return None
+            logging.info(f"Iniciando envio da consulta '{nome_consulta}'...")
+            return enviar_resultados(
+                pasta_consulta, portal, destino_tipo, destino_config, workers_envio, nome_consulta,
+                envios_simultaneos
+            )
 
-            except Exception as e:
-                consultas_status[nome_consulta] = False
-                logging.error(f"Erro inesperado ao enviar consulta '{nome_consulta}': {e}")
+        with ThreadPoolExecutor(max_workers=envios_simultaneos, thread_name_prefix="extrator-consultas-envio") as executor:
+            futuros = {
+                executor.submit(envia_consulta, nome_consulta, pasta_consulta): nome_consulta
+                for nome_consulta, pasta_consulta in pastas_resultados.items()
+            }
+            for futuro in as_completed(futuros):
+                nome_consulta = futuros[futuro]
+                try:
+                    sucesso = futuro.result()
+                    if sucesso is None:
+                        continue
+
+                    consultas_status[nome_consulta] = sucesso
+
+                    if sucesso:
+                        logging.info(f"Consulta '{nome_consulta}' enviada com sucesso.")
+                    else:
+                        logging.error(f"Falha no envio da consulta '{nome_consulta}'.")
+
+                except Exception as e:
+                    consultas_status[nome_consulta] = False
+                    logging.error(f"Erro inesperado ao enviar consulta '{nome_consulta}': {e}")
+
+        if parada_solicitada(stop_event):
+            return
 
         # Exibir um resumo final do envio
         sucessos = sum(1 for v in consultas_status.values() if v)  # Conta apenas os True
@@ -220,6 +302,9 @@ def main():
             logging.error("Nem todas as consultas foram enviadas corretamente. A tabela de atualização não será gerada.")
             return
 
+        if parada_solicitada(stop_event):
+            return
+
         logging.info("Todas as consultas foram enviadas com sucesso. Prosseguindo com a tabela de atualização...")
 
         # Enviar tabela de atualização apenas se todas as consultas foram bem-sucedidas
@@ -232,17 +317,31 @@ def main():
 
     finally:
         for thread in threading.enumerate():
-            if thread is not threading.main_thread():
+            # Apenas as threads dos executores do próprio extrator (prefixo "extrator-"); as demais,
+            # como as do agente quando executado em processo, não são de responsabilidade do main
+            if thread is not threading.current_thread() and thread.name.startswith("extrator-"):
                 logging.info(f"Aguardando thread {thread.name} encerrar...")
                 thread.join(timeout=5)
 
-    if os.path.exists("temp"):
-        shutil.rmtree("temp")
+    if remover_diretorio("temp", workers):
         logging.info("Diretório temporário removido.")
 
-    encerramento_processo = datetime.now(timezone).strftime("%d/%m/%Y %H:%M:%S")
+    encerramento_processo = datetime.now(TIMEZONE).strftime(FORMATO_DATA_HORA)
     logging.info(f"Sistema encerrado às {encerramento_processo}")
 
 
+def run(stop_event=None):
+    """
+    Ponto de entrada utilizado pelo agente para executar o sistema em uma thread do próprio processo.
+
+    Args:
+        stop_event (threading.Event, opcional): Evento para solicitar a parada da execução.
+    """
+    try:
+        main(stop_event, configurar_log=False)
+    except Exception as e:
+        logging.error(f"Execução do sistema principal finalizada com erro: {e}")
+
+
 if __name__ == "__main__":
     main()
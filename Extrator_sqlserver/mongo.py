@@ -1,13 +1,25 @@
+import atexit
 import logging
+import threading
 from bson import ObjectId
 from pymongo import MongoClient
 
+# Campos efetivamente usados pelo extrator (config.py e main.py); o restante dos documentos
+# não é trafegado nem decodificado
+CAMPOS_EMPRESA = {"name": 1, "TipoDestino": 1, "portal": 1, "parametrizacaoIntegracao": 1}
+CAMPOS_NUVEM = {"_id": 0, "Destino": 1}
+
 
 class MongoDBConnector:
     """
     Classe para gerenciar conexões e interações com o MongoDB.
     """
 
+    # Clientes compartilhados por URI: o MongoClient já mantém um pool de conexões e é
+    # thread-safe, e criá-lo custa resolução DNS/SRV, handshake TLS e descoberta da topologia
+    _clientes = {}
+    _lock_clientes = threading.Lock()
+
     def __init__(self, uri, database, collection):
         """
         Inicializa o conector do MongoDB com os parâmetros fornecidos.
@@ -23,69 +35,96 @@ class MongoDBConnector:
 
     def conectar(self):
         """
-        Retorna a conexão com o MongoDB dentro de um context manager.
+        Retorna o cliente do MongoDB para a URI, criado na primeira chamada e reaproveitado
+        pelos demais conectores e chamadas do processo.
         """
-        return MongoClient(self.uri)
-
-    def obter_parametros_empresa(self, idEmp):
+        with MongoDBConnector._lock_clientes:
+            client = MongoDBConnector._clientes.get(self.uri)
+            if client is None:
+                client = MongoClient(self.uri, maxPoolSize=8)
+                MongoDBConnector._clientes[self.uri] = client
+            return client
+
+    @classmethod
+    def encerrar_clientes(cls):
+        """
+        Fecha os clientes compartilhados (chamado ao encerrar o processo).
+        """
+        with cls._lock_clientes:
+            clientes, cls._clientes = list(cls._clientes.values()), {}
+        for client in clientes:
+            try:
+                client.close()
+            except Exception as e:
+                logging.error(f"Erro ao fechar conexão com o MongoDB: {e}")
+
+    def obter_parametros_empresa(self, idEmp, completo=False):
         """
         Obtém os parâmetros de configuração para o cliente especificado.
 
         Args:
             idEmp (str): HASH do cliente para busca no MongoDB.
+            completo (bool): Se True, retorna o documento inteiro; senão, apenas CAMPOS_EMPRESA.
 
         Returns:
             dict: Documento correspondente aos parâmetros do cliente, ou None se não encontrado.
         """
         try:
-            with self.conectar() as client:
-                logging.info("Conectando ao MongoDB...")
-                database = client[self.database_name]
-                collection = database[self.collection_name]
-
-                parametros = collection.find_one({"_id": ObjectId(idEmp)})
-                if not parametros:
-                    logging.warning(f"Cliente '{idEmp}' não encontrado no MongoDB.")
+            client = self.conectar()
+            logging.info("Conectando ao MongoDB...")
+            database = client[self.database_name]
+            collection = database[self.collection_name]
+
+            parametros = collection.find_one({"_id": ObjectId(idEmp)},
+                                             projection=None if completo else CAMPOS_EMPRESA)
+            if not parametros:
+                logging.warning(f"Cliente '{idEmp}' não encontrado no MongoDB.")
+                return None
+
+            # Validação de chaves essenciais
+            campos_essenciais = ["parametrizacaoIntegracao"]
+            for campo in campos_essenciais:
+                if campo not in parametros:
+                    logging.error(f"Parâmetro '{campo}' ausente para o cliente '{idEmp}' no MongoDB.")
                     return None
 
-                # Validação de chaves essenciais
-                campos_essenciais = ["parametrizacaoIntegracao"]
-                for campo in campos_essenciais:
-                    if campo not in parametros:
-                        logging.error(f"Parâmetro '{campo}' ausente para o cliente '{idEmp}' no MongoDB.")
-                        return None
-
-                nome_cliente = parametros.get("name", "Desconhecido")
-                logging.info(f"Parâmetros obtidos com sucesso do MongoDB para o cliente '{nome_cliente}'.")
-                return parametros
+            nome_cliente = parametros.get("name", "Desconhecido")
+            logging.info(f"Parâmetros obtidos com sucesso do MongoDB para o cliente '{nome_cliente}'.")
+            return parametros
 
         except Exception as e:
             logging.error(f"Erro ao buscar parâmetros no MongoDB: {e}")
             raise
 
-    def obter_parametros_nuvem(self):
+    def obter_parametros_nuvem(self, completo=False):
         """
         Obtém todos os documentos na collection para os parâmetros de configuração.
 
+        Args:
+            completo (bool): Se True, retorna os documentos inteiros; senão, apenas CAMPOS_NUVEM.
+
         Returns:
             list: Lista de documentos correspondentes aos parâmetros, ou lista vazia se nenhum for encontrado.
         """
         try:
-            with self.conectar() as client:
-                logging.info("Conectando ao MongoDB...")
-                database = client[self.database_name]
-                collection = database[self.collection_name]
+            client = self.conectar()
+            logging.info("Conectando ao MongoDB...")
+            database = client[self.database_name]
+            collection = database[self.collection_name]
 
-                parametros_cursor = collection.find()
-                parametros = list(parametros_cursor)
+            parametros_cursor = collection.find({}, projection=None if completo else CAMPOS_NUVEM)
+            parametros = list(parametros_cursor)
 
-                if not parametros:
-                    logging.warning(f"Parâmetros de destino não encontrados no MongoDB.")
-                    return []
+            if not parametros:
+                logging.warning(f"Parâmetros de destino não encontrados no MongoDB.")
+                return []
 
-                logging.info(f"Parâmetros obtidos com sucesso do MongoDB: {len(parametros)} documentos encontrados.")
-                return parametros
+            logging.info(f"Parâmetros obtidos com sucesso do MongoDB: {len(parametros)} documentos encontrados.")
+            return parametros
 
         except Exception as e:
             logging.error(f"Erro ao buscar parâmetros no MongoDB: {e}")
             raise
+
+
+atexit.register(MongoDBConnector.encerrar_clientes)
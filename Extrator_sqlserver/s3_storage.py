@@ -1,13 +1,19 @@
 import os
+import re
 import sys
 import asyncio
+import atexit
 import logging
+import threading
 import aiofiles
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Dict, List, Set, Tuple
+from contextlib import AsyncExitStack
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
 
 # Cliente síncrono para limpeza (boto3)
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 # Cliente assíncrono para upload (aioboto3)
 import aioboto3
 import aioboto3.s3
@@ -18,78 +24,172 @@ import aioboto3.s3.inject
 # --------------------------------------------------
 logging.basicConfig(level=logging.INFO)
 
+# --------------------------------------------------
+# POOL DE CONEXÕES DO CLIENTE SÍNCRONO
+# --------------------------------------------------
+# Conexões mantidas pelo cliente boto3 (o padrão é 10, o que gera "Connection pool is full"
+# e novos handshakes TLS quando listagens e lotes de deleção rodam em mais threads)
+TAMANHO_POOL_S3 = 64
+
+# --------------------------------------------------
+# EVENT LOOP E CLIENTES COMPARTILHADOS
+# --------------------------------------------------
+# O cliente aioboto3 (e seu pool de conexões) fica preso ao event loop em que foi criado;
+# por isso os uploads rodam num único loop de longa duração em vez de um asyncio.run por chamada.
+_loop_s3: Optional[asyncio.AbstractEventLoop] = None
+_lock_loop_s3 = threading.Lock()
+# Clientes por credencial (chave, segredo, região): o s3_config é recriado a cada execução do
+# main, mas o processo do agente é longo, então os clientes sobrevivem entre execuções
+_clientes_async: Dict[Tuple[Optional[str], Optional[str], Optional[str]], object] = {}
+_clientes_sync: Dict[Tuple[Optional[str], Optional[str], Optional[str]], object] = {}
+_lock_clientes_sync = threading.Lock()
+# Contextos dos clientes assíncronos abertos (fechados em encerrar_clientes_async)
+_pilha_clientes_async = AsyncExitStack()
+_lock_clientes_async: Optional[asyncio.Lock] = None
+
+def chave_credenciais(s3_config: dict) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """Chave de cache dos clientes: chave de acesso, segredo e região."""
+    return s3_config.get("access_key"), s3_config.get("secret_key"), s3_config.get("region")
+
+def obter_loop_s3() -> asyncio.AbstractEventLoop:
+    """Retorna o event loop dedicado ao S3, iniciando-o numa thread daemon na primeira chamada."""
+    global _loop_s3
+    with _lock_loop_s3:
+        if _loop_s3 is None:
+            _loop_s3 = asyncio.new_event_loop()
+            threading.Thread(target=_loop_s3.run_forever, name="s3-loop", daemon=True).start()
+        return _loop_s3
+
+def executar_no_loop_s3(coro):
+    """Executa a corrotina no loop dedicado ao S3 e aguarda o resultado (bloqueante)."""
+    return asyncio.run_coroutine_threadsafe(coro, obter_loop_s3()).result()
+
+async def obter_cliente_async(s3_config: dict, max_concurrency: int):
+    """
+    Retorna o cliente aioboto3 das credenciais, criando-o (sessão + cliente) na primeira chamada
+    do processo. Deve ser chamado dentro do loop do S3.
+    """
+    global _lock_clientes_async
+    if _lock_clientes_async is None:
+        _lock_clientes_async = asyncio.Lock()
+    chave = chave_credenciais(s3_config)
+    async with _lock_clientes_async:
+        cliente = _clientes_async.get(chave)
+        if cliente is None:
+            session = aioboto3.Session(
+                aws_access_key_id=s3_config["access_key"],
+                aws_secret_access_key=s3_config["secret_key"],
+                region_name=s3_config.get("region")
+            )
+            # Pool do cliente igual à concorrência de uploads; o modo "adaptive" reenvia com backoff as
+            # respostas de throttling (503 SlowDown) e reduz a taxa de envio enquanto elas persistirem
+            config = Config(max_pool_connections=max_concurrency,
+                            retries={"max_attempts": 10, "mode": "adaptive"})
+            cliente = await _pilha_clientes_async.enter_async_context(session.client("s3", config=config))
+            _clientes_async[chave] = cliente
+    return cliente
+
+def encerrar_clientes_async():
+    """Fecha os clientes assíncronos compartilhados e para o loop do S3 ao final do processo."""
+    if _loop_s3 is None:
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_pilha_clientes_async.aclose(), _loop_s3).result(timeout=10)
+    except Exception as e:
+        logging.warning(f"Erro ao fechar clientes assíncronos do S3: {e}")
+    _loop_s3.call_soon_threadsafe(_loop_s3.stop)
+
+atexit.register(encerrar_clientes_async)
+
 # --------------------------------------------------
 # VALIDAÇÃO DA CONFIGURAÇÃO S3
 # --------------------------------------------------
 def validar_config_s3(s3_config):
     """Valida e inicializa a configuração do S3 se necessário."""
+    if not s3_config.get("bucket"):
+        raise ValueError("Configuração do S3 está incompleta. Forneça 'bucket'.")
     if "s3_client" not in s3_config:
-        s3_config["s3_client"] = boto3.client(
-            "s3",
-            aws_access_key_id=s3_config.get("access_key"),
-            aws_secret_access_key=s3_config.get("secret_key"),
-            region_name=s3_config.get("region"),
-        )
-        logging.info("Conexão com o S3 inicializada com sucesso.")
+        # Um cliente por credencial no processo, compartilhado entre threads e execuções (clientes
+        # boto3 são thread-safe; com credenciais estáticas não há renovação de credenciais a disputar).
+        # O keepalive TCP mantém as conexões do pool vivas entre execuções espaçadas do agente
+        with _lock_clientes_sync:
+            chave = chave_credenciais(s3_config)
+            if chave not in _clientes_sync:
+                _clientes_sync[chave] = boto3.client(
+                    "s3",
+                    aws_access_key_id=s3_config.get("access_key"),
+                    aws_secret_access_key=s3_config.get("secret_key"),
+                    region_name=s3_config.get("region"),
+                    config=Config(max_pool_connections=TAMANHO_POOL_S3, tcp_keepalive=True),
+                )
+                logging.info("Conexão com o S3 inicializada com sucesso.")
+        s3_config["s3_client"] = _clientes_sync[chave]
     return s3_config
 
 # --------------------------------------------------
-# FUNÇÕES AUXILIARES PARA DELEÇÃO EM BATCH (SÍNCRONA)
+# FUNÇÕES AUXILIARES PARA DELEÇÃO EM BATCH (ASSÍNCRONA)
 # --------------------------------------------------
+# Limite do serviço: no máximo 1000 chaves por requisição delete_objects
+TAMANHO_LOTE_S3 = 1000
+
 def chunk_list(lst: List, chunk_size: int):
     """Divide uma lista em pedaços (chunks) de tamanho chunk_size."""
     for i in range(0, len(lst), chunk_size):
         yield lst[i:i + chunk_size]
 
-def executar_exclusao_objetos_batch(s3_client, bucket: str, object_keys: List[str],
-                                    max_workers: int = 10, dry_run: bool = False,
-                                    nome_consulta: str = "") -> None:
+async def excluir_lote_s3_async(s3_client, bucket: str, chunk: List[str]) -> Optional[Tuple[Exception, List[str]]]:
     """
-    Realiza a deleção em batch dos objetos utilizando o método delete_objects do S3.
-    Deleta até 1000 objetos por requisição.
-
-    Parâmetros:
-      - s3_client: Cliente síncrono do boto3.
-      - bucket: Nome do bucket.
-      - object_keys: Lista de chaves dos objetos a serem deletados.
-      - max_workers: Número máximo de threads para deleção concorrente.
-      - dry_run: Se True, apenas loga os objetos que seriam deletados.
-      - nome_consulta: Identificador para os logs.
+    Deleta um lote de até 1000 objetos em uma única requisição delete_objects (cliente aioboto3).
+    Retorna None em caso de sucesso ou (erro, chaves com falha).
     """
-    if dry_run:
-        logging.info(f"[{nome_consulta}] Dry run ativado: {len(object_keys)} objetos seriam deletados.")
-        return
+    try:
+        response = await s3_client.delete_objects(
+            Bucket=bucket,
+            Delete={
+                'Objects': [{'Key': key} for key in chunk],
+                'Quiet': True
+            }
+        )
+    except Exception as e:
+        return e, chunk
+    if response.get('Errors'):
+        return Exception(f"Erros no batch: {response['Errors']}"), [erro['Key'] for erro in response['Errors']]
+    return None
 
-    errors = []
-    def delete_batch(chunk: List[str]):
-        try:
-            response = s3_client.delete_objects(
-                Bucket=bucket,
-                Delete={
-                    'Objects': [{'Key': key} for key in chunk],
-                    'Quiet': True
-                }
-            )
-            if 'Errors' in response and response['Errors']:
-                raise Exception(f"Erros no batch: {response['Errors']}")
-        except Exception as e:
-            return e, chunk
-        return None
-
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(delete_batch, chunk): chunk for chunk in chunk_list(object_keys, 1000)}
-        for future in as_completed(futures):
-            result = future.result()
-            if result is not None:
-                err, chunk = result
-                errors.append((err, chunk))
-                logging.error(f"[{nome_consulta}] Erro ao deletar lote: {err}. Objetos: {chunk}")
+async def executar_exclusao_objetos_batch_async(s3_client, bucket: str, object_keys: List[str],
+                                                max_in_flight: int) -> List[Tuple[Exception, List[str]]]:
+    """
+    Executa a deleção com no máximo `max_in_flight` lotes em voo: um número fixo de tarefas
+    consome os lotes sob demanda, em vez de criar de antemão uma tarefa por lote.
+    Retorna a lista de erros (erro, chaves) encontrados.
+    """
+    # Gerador compartilhado: cada tarefa obtém o próximo lote somente quando termina o anterior
+    lotes = chunk_list(object_keys, TAMANHO_LOTE_S3)
+    total_lotes = -(-len(object_keys) // TAMANHO_LOTE_S3)
+
+    async def consumir_lotes() -> List[Tuple[Exception, List[str]]]:
+        erros = []
+        for chunk in lotes:
+            resultado = await excluir_lote_s3_async(s3_client, bucket, chunk)
+            if resultado is not None:
+                erros.append(resultado)
+        return erros
+
+    resultados = await asyncio.gather(
+        *(consumir_lotes() for _ in range(max(1, min(max_in_flight, total_lotes))))
+    )
+    return [erro for erros in resultados for erro in erros]
+
+def registrar_resultado_exclusao(errors: List[Tuple[Exception, List[str]]], total: int, nome_consulta: str = "") -> None:
+    """Registra os erros da deleção em batch e lança exceção se algum lote falhou."""
+    for err, chunk in errors:
+        logging.error(f"[{nome_consulta}] Erro ao deletar lote: {err}. Objetos: {chunk}")
 
     if errors:
         logging.error(f"[{nome_consulta}] Erros durante a deleção em batch: {errors}")
         raise Exception("Falha na deleção em batch de objetos.")
     else:
-        logging.info(f"[{nome_consulta}] Deleção em batch concluída com sucesso para {len(object_keys)} objetos.")
+        logging.info(f"[{nome_consulta}] Deleção em batch concluída com sucesso para {total} objetos.")
 
 # --------------------------------------------------
 # FUNÇÕES DE LISTAGEM, EXTRAÇÃO E FILTRAGEM DE PARTIÇÕES (S3)
@@ -99,54 +199,83 @@ def normalizar_particao(particao: str) -> str:
     return particao.rstrip("/")
 
 def formatar_particoes_log(particoes: Set[str], nivel: str) -> str:
-    """Formata as partições para log: exibe a primeira, a última e o total."""
+    """Formata as partições para log (primeira, última e total); recebe strings já normalizadas."""
     if not particoes:
         return ""
-    norm = {normalizar_particao(p) for p in particoes}
-    particoes_ordenadas = sorted(norm)
+    particoes_ordenadas = sorted(particoes)
     total = len(particoes_ordenadas)
     if total == 1:
         return f"{nivel}: {particoes_ordenadas[0]} (1 partição)"
     return f"{nivel}: {particoes_ordenadas[0]} ... {particoes_ordenadas[-1]} ({total} partições)"
 
-def listar_objetos_s3(s3_client, bucket: str, prefix: str) -> List[dict]:
-    """Lista todos os objetos existentes no bucket que começam com o prefixo informado."""
-    objetos = []
-    response = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
-    while response.get("Contents"):
-        objetos.extend(response["Contents"])
-        if response.get("IsTruncated"):
-            response = s3_client.list_objects_v2(
-                Bucket=bucket,
-                Prefix=prefix,
-                ContinuationToken=response["NextContinuationToken"]
-            )
-        else:
-            break
-    return objetos
+def listar_chaves_s3(s3_client, bucket: str, prefix: str) -> List[str]:
+    """
+    Lista as chaves de todos os objetos no bucket que começam com o prefixo informado.
+    O paginator do list_objects_v2 segue o ContinuationToken automaticamente (páginas de 1000).
+    """
+    paginas = s3_client.get_paginator("list_objects_v2").paginate(
+        Bucket=bucket, Prefix=prefix, PaginationConfig={"PageSize": 1000}
+    )
+    return [obj["Key"] for pagina in paginas for obj in pagina.get("Contents", [])]
 
-def extrair_particoes_dos_objetos(objetos: List[dict]) -> Set[str]:
+def agrupar_chaves_por_particao(chaves: List[str], prefixo: str) -> Dict[str, List[str]]:
     """
-    Extrai as partições a partir das chaves dos objetos.
-    Considera como partição a string resultante de remover o último segmento (nome do arquivo)
-    e normaliza a string (remove trailing slash).
+    Agrupa, em uma única passada, as chaves pela partição a que pertencem.
+    A partição é o caminho sem o último segmento (nome do arquivo), normalizado e sem o
+    prefixo remoto (resultando em "idEmpresa=XYZ/..."). Marcadores de diretório (terminados
+    em "/") definem a partição, mas não entram na lista de chaves.
     """
-    return {normalizar_particao("/".join(obj["Key"].split("/")[:-1])) for obj in objetos}
+    inicio = normalizar_particao(prefixo) + "/"
+    grupos: Dict[str, List[str]] = {}
+    for chave in chaves:
+        particao = normalizar_particao(chave.rpartition("/")[0])
+        if particao.startswith(inicio):
+            particao = normalizar_particao(particao[len(inicio):])
+        nomes = grupos.setdefault(particao, [])
+        if not chave.endswith("/"):
+            nomes.append(chave)
+    return grupos
+
+def raizes_particoes(particoes: Set[str]) -> Set[str]:
+    """Retorna as partições que não estão contidas em nenhuma outra do conjunto (já normalizado)."""
+    def tem_ancestral(p: str) -> bool:
+        fim = p.rfind("/")
+        while fim > 0:
+            if p[:fim] in particoes:
+                return True
+            fim = p.rfind("/", 0, fim)
+        return False
+    return {p for p in particoes if not tem_ancestral(p)}
 
 def filtrar_particoes_existentes(particoes_existentes: Set[str], particoes_recarregadas: Set[str]) -> Set[str]:
     """
     Mantém somente as partições existentes que pertençam ao conjunto de partições recarregadas.
-    A verificação é feita após normalizar ambas as strings.
+    Ambos os conjuntos devem chegar já normalizados (ver selecionar_chaves_para_exclusao).
     """
-    recarregadas_norm = {normalizar_particao(r) for r in particoes_recarregadas}
     def pertence_recarregadas(p: str) -> bool:
-        p_norm = normalizar_particao(p)
-        for rec in recarregadas_norm:
-            if p_norm == rec or p_norm.startswith(rec + "/"):
+        # Testa a própria partição e cada prefixo "a/b/..." por pertinência ao conjunto,
+        # em vez de comparar com cada partição recarregada
+        if p in particoes_recarregadas:
+            return True
+        fim = p.rfind("/")
+        while fim > 0:
+            if p[:fim] in particoes_recarregadas:
                 return True
+            fim = p.rfind("/", 0, fim)
         return False
     return {p for p in particoes_existentes if pertence_recarregadas(p)}
 
+PADRAO_PARTICAO = re.compile(r"^(idEmpresa=[^/]+)(?:/(Ano=[^/]+))?(?:/(Mes=[^/]+))?")
+
+def interpretar_particoes(particoes: Set[str]) -> Dict[str, Tuple[str, Optional[str], Optional[str]]]:
+    """Extrai a tupla (idEmpresa, Ano, Mes) de cada partição (já normalizada)."""
+    resultado = {}
+    for p in particoes:
+        m = PADRAO_PARTICAO.match(p)
+        if m:
+            resultado[p] = m.groups()
+    return resultado
+
 def definir_particoes_para_exclusao(particoes_existentes: Set[str], particoes_recarregadas: Set[str]) -> Dict[str, Set[str]]:
     """
     Define as partições a serem excluídas de acordo com o tipo de consulta:
@@ -154,185 +283,267 @@ def definir_particoes_para_exclusao(particoes_existentes: Set[str], particoes_re
         a exclusão será feita a nível de idEmpresa.
       - Tipo B (idEmpresa + Data): Se houver informações de data, avalia os níveis Dia, Mes e Ano,
         excluindo somente os dados que estão sendo recarregados.
-    Todas as comparações são feitas com strings normalizadas.
+    Ambos os conjuntos devem chegar já normalizados (ver selecionar_chaves_para_exclusao).
     """
     if not particoes_existentes:
         return {}
 
-    particoes_recarregadas_norm = {normalizar_particao(r) for r in particoes_recarregadas}
-    tem_data = any(token in r for r in particoes_recarregadas_norm for token in ("Ano=", "Mes="))
+    recarregadas = interpretar_particoes(particoes_recarregadas)
+    existentes = interpretar_particoes(particoes_existentes)
+
+    # Índices das partições existentes por idEmpresa e por (idEmpresa, Ano)
+    existentes_por_empresa: Dict[str, Set[str]] = {}
+    existentes_por_ano: Dict[Tuple[str, str], Set[str]] = {}
+    for p_norm, (id_empresa, ano, _) in existentes.items():
+        existentes_por_empresa.setdefault(id_empresa, set()).add(p_norm)
+        if ano is not None:
+            existentes_por_ano.setdefault((id_empresa, ano), set()).add(p_norm)
+
+    id_empresas = {id_empresa for id_empresa, _, _ in recarregadas.values()}
+    tem_data = any(ano is not None or mes is not None for _, ano, mes in recarregadas.values())
     if not tem_data:
-        exclusao = {"idEmpresa": set()}
-        id_empresas = {normalizar_particao(r).split("/")[0] for r in particoes_recarregadas_norm if "idEmpresa=" in r}
-        for id_empresa in id_empresas:
-            if any(normalizar_particao(p).startswith(id_empresa) for p in particoes_existentes):
-                exclusao["idEmpresa"].add(id_empresa)
-        return exclusao
-    else:
-        exclusao = {"Mes": set(), "Ano": set(), "idEmpresa": set()}
-        exclusao["Mes"] = {normalizar_particao(r) for r in particoes_recarregadas_norm if all(token in r for token in ("Ano=", "Mes="))}
-        anos_map: Dict[str, Set[str]] = {}
-        for mes in exclusao["Mes"]:
-            ano = mes.split("/")[0]
-            anos_map.setdefault(ano, set()).add(mes)
-        for ano, meses_recarregados in anos_map.items():
-            meses_existentes = {normalizar_particao(p) for p in particoes_existentes if normalizar_particao(p).startswith(ano)}
-            if meses_existentes and meses_existentes == meses_recarregados:
-                exclusao["Ano"].add(ano)
-        particoes_excluidas = exclusao["Mes"] | exclusao["Ano"]
-        id_empresas = {normalizar_particao(r).split("/")[0] for r in particoes_recarregadas_norm if "idEmpresa=" in r}
-        for id_empresa in id_empresas:
-            particoes_empresa = {normalizar_particao(p) for p in particoes_existentes if normalizar_particao(p).startswith(id_empresa)}
-            if particoes_empresa and particoes_empresa.issubset(particoes_excluidas):
-                exclusao["idEmpresa"].add(id_empresa)
-            else:
-                logging.info(f"{id_empresa} NÃO será excluída pois possui partições válidas não recarregadas.")
-        return exclusao
-def limpar_prefixo_no_s3(s3_client, bucket: str, caminho_destino: str,
-                         particoes_recarregadas: List[str], workers: int = 10,
-                         dry_run: bool = False, nome_consulta: str = "") -> None:
+        return {"idEmpresa": {id_empresa for id_empresa in id_empresas if id_empresa in existentes_por_empresa}}
+
+    exclusao = {"Mes": set(), "Ano": set(), "idEmpresa": set()}
+    meses_por_ano: Dict[Tuple[str, str], Set[str]] = {}
+    for p_norm, (id_empresa, ano, mes) in recarregadas.items():
+        if ano is not None and mes is not None:
+            exclusao["Mes"].add(p_norm)
+            meses_por_ano.setdefault((id_empresa, ano), set()).add(p_norm)
+    for (id_empresa, ano), meses_recarregados in meses_por_ano.items():
+        meses_existentes = existentes_por_ano.get((id_empresa, ano))
+        if meses_existentes and meses_existentes == meses_recarregados:
+            exclusao["Ano"].add(f"{id_empresa}/{ano}")
+    particoes_excluidas = exclusao["Mes"] | exclusao["Ano"]
+    for id_empresa in id_empresas:
+        particoes_empresa = existentes_por_empresa.get(id_empresa)
+        if particoes_empresa and particoes_empresa.issubset(particoes_excluidas):
+            exclusao["idEmpresa"].add(id_empresa)
+        else:
+            logging.info(f"{id_empresa} NÃO será excluída pois possui partições válidas não recarregadas.")
+    return exclusao
+
+def selecionar_chaves_para_exclusao(s3_client, bucket: str, caminho_destino: str,
+                                    particoes_recarregadas: List[str], workers: int = 10,
+                                    nome_consulta: str = "") -> List[str]:
     """
-    Orquestra a limpeza no S3:
-      1. Lista os objetos com o prefixo.
+    Seleciona as chaves a excluir no S3 (lista vazia quando não há o que limpar):
+      1. Lista (paginado) os objetos de cada raiz recarregada, uma única vez.
       2. Extrai e filtra as partições existentes (mantendo apenas as da recarga).
       3. Define as partições a serem excluídas.
-      4. Obtém a lista de objetos (chaves) a serem deletados.
-      5. Executa a deleção em batch de forma concorrente (com modo dry_run opcional).
+      4. Seleciona, na mesma listagem, as chaves a serem deletadas.
     """
     if not particoes_recarregadas:
         logging.info(f"[{nome_consulta}] Nenhuma partição para exclusão no S3.")
-        return
+        return []
+    recarregadas_norm = {normalizar_particao(r) for r in particoes_recarregadas}
 
-    objetos = listar_objetos_s3(s3_client, bucket, caminho_destino)
-    particoes_existentes = extrair_particoes_dos_objetos(objetos)
+    # Lista uma única vez cada raiz recarregada (ex.: "idEmpresa=XYZ/"), sem trazer os objetos
+    # das demais empresas. O "/" final evita prefixos irmãos ("idEmpresa=1" x "idEmpresa=10")
+    base = normalizar_particao(caminho_destino)
+    prefixos = [f"{base}/{raiz}/" for raiz in sorted(raizes_particoes(recarregadas_norm))]
+    chaves = []
+    if len(prefixos) == 1:
+        chaves = listar_chaves_s3(s3_client, bucket, prefixos[0])
+    else:
+        # Raízes distintas são listadas em paralelo (a latência de cada página domina a listagem)
+        with ThreadPoolExecutor(max_workers=min(workers, len(prefixos)), thread_name_prefix="extrator-s3") as executor:
+            for chaves_raiz in executor.map(lambda prefixo: listar_chaves_s3(s3_client, bucket, prefixo), prefixos):
+                chaves.extend(chaves_raiz)
+    if not chaves:
+        # Prefixo ainda vazio (ex.: primeira extração): não há o que limpar
+        logging.info(f"[{nome_consulta}] Prefixo '{caminho_destino}' vazio no S3. Limpeza ignorada.")
+        return []
+    # Mapeia partição ("idEmpresa=XYZ/...", sem o prefixo remoto) -> chaves, a partir da listagem única
+    chaves_por_particao = agrupar_chaves_por_particao(chaves, caminho_destino)
     # Filtra apenas aquelas que contenham "idEmpresa="
-    particoes_existentes = {normalizar_particao(p) for p in particoes_existentes if "idEmpresa=" in p}
-    # Remove o prefixo remoto (caminho_destino) se presente, para que o resultado seja apenas "idEmpresa=XYZ/..."
-    prefixo = normalizar_particao(caminho_destino)
-    particoes_existentes = {
-        normalizar_particao(p[len(prefixo)+1:]) if p.startswith(prefixo + "/") else normalizar_particao(p)
-        for p in particoes_existentes
-    }
+    particoes_existentes = {p for p in chaves_por_particao if "idEmpresa=" in p}
     # Agora compara com as partições recarregadas (que devem conter apenas o final do caminho)
-    particoes_existentes = filtrar_particoes_existentes(particoes_existentes, {normalizar_particao(r) for r in particoes_recarregadas})
+    particoes_existentes = filtrar_particoes_existentes(particoes_existentes, recarregadas_norm)
     if not particoes_existentes:
         logging.info(f"[{nome_consulta}] Nenhuma partição existente (pertencente à recarga) encontrada para o prefixo '{caminho_destino}'.")
-        return
+        return []
 
-    exclusao = definir_particoes_para_exclusao(particoes_existentes, set(particoes_recarregadas))
+    exclusao = definir_particoes_para_exclusao(particoes_existentes, recarregadas_norm)
     if not exclusao:
         logging.info(f"[{nome_consulta}] Não há partições marcadas para exclusão.")
-        return
+        return []
 
     for nivel, parts in exclusao.items():
         log_msg = formatar_particoes_log(parts, nivel)
         if log_msg:
             logging.info(f"[{nome_consulta}] Exclusão no nível {nivel}: {log_msg}")
 
-    object_keys = []
-    for nivel, parts in exclusao.items():
-        for particao in parts:
-            prefixo_completo = f"{caminho_destino}/{particao}".rstrip("/") + "/"
-            response = s3_client.list_objects_v2(Bucket=bucket, Prefix=prefixo_completo)
-            if "Contents" in response:
-                object_keys.extend([obj["Key"] for obj in response["Contents"] if not obj["Key"].endswith("/")])
+    # A listagem inicial já contém todas as chaves das raízes recarregadas: seleciona as
+    # partições excluídas e suas subpartições no mapa, sem uma listagem por partição
+    particoes_excluidas = {particao for parts in exclusao.values() for particao in parts}
+    prefixos_exclusao = tuple(particao + "/" for particao in particoes_excluidas)
+    object_keys = [
+        chave
+        for particao, chaves_particao in chaves_por_particao.items()
+        if particao in particoes_excluidas or particao.startswith(prefixos_exclusao)
+        for chave in chaves_particao
+    ]
 
     if not object_keys:
         logging.info(f"[{nome_consulta}] Nenhum objeto encontrado para exclusão no S3.")
-        return
+        return []
 
     logging.info(f"[{nome_consulta}] {len(object_keys)} objetos serão deletados (processo crítico).")
-    executar_exclusao_objetos_batch(s3_client, bucket, object_keys, max_workers=workers, dry_run=dry_run, nome_consulta=nome_consulta)
+    return object_keys
 
 # --------------------------------------------------
 # FUNÇÕES DE UPLOAD ASSÍNCRONO – S3 (USANDO aioboto3)
 # --------------------------------------------------
-async def upload_file_s3_async(semaphore: asyncio.Semaphore,
-                               s3_client,
+# Até este tamanho o arquivo vai em um único PutObject; acima dele o upload é multipart,
+# em partes do mesmo tamanho, com poucas partes do mesmo arquivo em paralelo
+TAMANHO_PARTE_S3 = 8 * 1024 * 1024
+CONCORRENCIA_PARTES_S3 = 4
+# Uploads em voo por credencial somando todos os envios simultâneos: o cliente compartilhado é
+# dimensionado por ele, e cada envio recebe a sua fração em max_concurrency (ver storage.py)
+UPLOADS_CONCORRENTES_S3 = 64
+CONFIG_TRANSFERENCIA_S3 = TransferConfig(multipart_threshold=TAMANHO_PARTE_S3,
+                                         multipart_chunksize=TAMANHO_PARTE_S3,
+                                         max_concurrency=CONCORRENCIA_PARTES_S3)
+
+async def upload_file_s3_async(s3_client,
                                bucket: str,
                                local_path: str,
                                destino_path: str) -> str:
     """
-    Realiza o upload assíncrono de um único arquivo para o S3,
-    utilizando um semáforo para limitar o número de uploads concorrentes.
+    Realiza o upload assíncrono de um único arquivo para o S3.
+    O arquivo é enviado em streaming (upload_fileobj): apenas as partes em voo (TAMANHO_PARTE_S3
+    cada) ficam em memória, em vez do arquivo inteiro. Erros são propagados e registrados
+    uma única vez, em resumo, por realizar_upload_s3_async.
     """
-    async with semaphore:
-        try:
-            async with aiofiles.open(local_path, "rb") as f:
-                data = await f.read()
-            await s3_client.put_object(Bucket=bucket, Key=destino_path, Body=data)
-         #   logging.info(f"Upload realizado: {destino_path}")
-            return destino_path
-        except Exception as e:
-            logging.error(f"Erro ao fazer upload de '{destino_path}': {e}")
-            raise
+    async with aiofiles.open(local_path, "rb") as f:
+        await s3_client.upload_fileobj(f, bucket, destino_path, Config=CONFIG_TRANSFERENCIA_S3)
+    return destino_path
 
 async def realizar_upload_s3_async(temp_dir: str,
                                    caminho_destino: str,
                                    s3_config: Dict,
-                                   max_concurrency: int = 1000,
-                                   nome_consulta: str = "") -> dict:
+                                   max_concurrency: int = UPLOADS_CONCORRENTES_S3,
+                                   nome_consulta: str = "",
+                                   arquivos: Optional[List[Tuple[str, str]]] = None) -> dict:
     """
     Orquestra o upload assíncrono para o S3:
-      1. Lista recursivamente todos os arquivos em temp_dir.
-      2. Para cada arquivo, determina o destino (baseado em caminho_destino).
-      3. Executa uploads concorrentes controlados por semáforo.
+      1. Lista recursivamente todos os arquivos em temp_dir (se `arquivos`, pares (caminho, chave
+         de destino baseada em caminho_destino), não for informado).
+      2. Executa os uploads com no máximo `max_concurrency` tarefas concorrentes.
     """
     bucket = s3_config["bucket"]
-    session = aioboto3.Session(
-        aws_access_key_id=s3_config["access_key"],
-        aws_secret_access_key=s3_config["secret_key"],
-        region_name=s3_config.get("region")
-    )
-    async with session.client('s3') as s3_client:
-        arquivos = []
-        for root, _, files in os.walk(temp_dir):
-            for file in files:
-                arquivos.append(os.path.join(root, file))
-        if not arquivos:
-            logging.info(f"[{nome_consulta}] Nenhum arquivo encontrado para upload em '{temp_dir}'.")
-            return {"enviados": [], "erros": []}
-        logging.info(f"[{nome_consulta}] Iniciando upload de {len(arquivos)} arquivos para o S3 com {max_concurrency} uploads concorrentes...")
-        semaphore = asyncio.Semaphore(max_concurrency)
-        tasks = []
-        for file_path in arquivos:
-            relative_path = os.path.relpath(file_path, temp_dir).replace(os.sep, "/")
-            destino_path = f"{caminho_destino}/{relative_path}"
-            tasks.append(upload_file_s3_async(semaphore, s3_client, bucket, file_path, destino_path))
-        enviados = []
-        erros = []
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        for result in results:
-            if isinstance(result, Exception):
-                erros.append(str(result))
-            else:
-                enviados.append(result)
-        logging.info(f"[{nome_consulta}] Upload concluído. Enviados: {len(enviados)}, Erros: {len(erros)}")
-        return {"enviados": enviados, "erros": erros}
+    # Cliente assíncrono compartilhado entre chamadas (não é fechado aqui; ver encerrar_clientes_async)
+    s3_client = await obter_cliente_async(s3_config, UPLOADS_CONCORRENTES_S3)
+    if arquivos is None:
+        _, arquivos = listar_particoes_e_arquivos(temp_dir, caminho_destino)
+    if not arquivos:
+        logging.info(f"[{nome_consulta}] Nenhum arquivo encontrado para upload em '{temp_dir}'.")
+        return {"enviados": [], "erros": []}
+    logging.info(f"[{nome_consulta}] Iniciando upload de {len(arquivos)} arquivos para o S3 com {max_concurrency} uploads concorrentes...")
+    enviados = []
+    erros = []
+    # Iterador compartilhado: um número fixo de tarefas consome os arquivos sob demanda, em vez de
+    # criar de antemão uma tarefa por arquivo (as listas não precisam de lock: um único event loop)
+    pendentes = iter(arquivos)
+
+    async def consumir_arquivos():
+        for file_path, destino_path in pendentes:
+            try:
+                enviados.append(await upload_file_s3_async(s3_client, bucket, file_path, destino_path))
+            except Exception as e:
+                erros.append(f"{destino_path}: {e}")
+
+    await asyncio.gather(*(consumir_arquivos() for _ in range(max(1, min(max_concurrency, len(arquivos))))))
+    if erros:
+        # Um único registro por chamada, em vez de um por arquivo com falha
+        logging.error(f"[{nome_consulta}] {len(erros)} falhas de upload; primeiras {min(10, len(erros))}: {erros[:10]}")
+    logging.info(f"[{nome_consulta}] Upload concluído. Enviados: {len(enviados)}, Erros: {len(erros)}")
+    return {"enviados": enviados, "erros": erros}
+
+async def limpar_e_enviar_s3_async(temp_dir: str,
+                                   caminho_destino: str,
+                                   s3_config: Dict,
+                                   object_keys: List[str],
+                                   arquivos: List[Tuple[str, str]],
+                                   workers: int = 10,
+                                   max_concurrency: int = UPLOADS_CONCORRENTES_S3,
+                                   dry_run: bool = False,
+                                   nome_consulta: str = "") -> dict:
+    """
+    Executa a deleção dos objetos antigos e o upload dos novos arquivos concorrentemente, no mesmo
+    cliente aioboto3, cada etapa com seu próprio limite (workers lotes de deleção / max_concurrency uploads).
+    Chaves que serão sobrescritas pelo upload saem da lista de deleção, de modo que as duas
+    etapas atuam sobre chaves disjuntas e a deleção nunca remove um arquivo recém-enviado.
+    """
+    destinos = {destino_path for _, destino_path in arquivos}
+    object_keys = [chave for chave in object_keys if chave not in destinos]
+
+    etapas = [realizar_upload_s3_async(temp_dir, caminho_destino, s3_config, max_concurrency,
+                                       nome_consulta, arquivos=arquivos)]
+    if object_keys and dry_run:
+        logging.info(f"[{nome_consulta}] Dry run ativado: {len(object_keys)} objetos seriam deletados.")
+    elif object_keys:
+        s3_client = await obter_cliente_async(s3_config, UPLOADS_CONCORRENTES_S3)
+        etapas.append(executar_exclusao_objetos_batch_async(s3_client, s3_config["bucket"], object_keys, workers))
+
+    resultados = await asyncio.gather(*etapas)
+    if len(resultados) > 1:
+        registrar_resultado_exclusao(resultados[1], len(object_keys), nome_consulta)
+    return resultados[0]
+
+# --------------------------------------------------
+# VARREDURA LOCAL DE PARTIÇÕES E ARQUIVOS
+# --------------------------------------------------
+def listar_particoes_e_arquivos(temp_dir: str, caminho_destino: str) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """
+    Percorre temp_dir uma única vez (os.scandir) e retorna:
+      - as partições locais (diretórios com "idEmpresa="), relativas a temp_dir;
+      - os pares (caminho local, chave de destino) de todos os arquivos a serem enviados.
+    O caminho relativo de cada diretório é montado uma vez durante a varredura, de modo que
+    a chave de cada arquivo é uma concatenação (sem os.path.relpath por arquivo).
+    """
+    particoes = []
+    arquivos = []
+    # Pilha de (diretório, chave de destino correspondente ao diretório, está numa partição).
+    # Um diretório está numa partição se o pai está ou se o próprio nome começa com "idEmpresa=":
+    # o teste é feito sobre o nome de cada entrada, não sobre o caminho inteiro
+    pendentes = [(temp_dir, caminho_destino, "idEmpresa=" in temp_dir)]
+    while pendentes:
+        root, destino_root, em_particao = pendentes.pop()
+        if em_particao:
+            particoes.append(os.path.relpath(root, temp_dir).replace(os.sep, "/"))
+        with os.scandir(root) as entradas:
+            for entrada in entradas:
+                if entrada.is_dir(follow_symlinks=False):
+                    pendentes.append((entrada.path, f"{destino_root}/{entrada.name}",
+                                      em_particao or entrada.name.startswith("idEmpresa=")))
+                elif entrada.is_file():
+                    arquivos.append((entrada.path, f"{destino_root}/{entrada.name}"))
+    return particoes, arquivos
 
 # --------------------------------------------------
 # FUNÇÃO FINAL – INTEGRA LIMPEZA (SÍNCRONA) E UPLOAD (ASSÍNCRONO) PARA S3
 # --------------------------------------------------
 def realizar_upload_s3(temp_dir: str, caminho_destino: str, s3_config: Dict,
-                       workers: int = 10, max_concurrency: int = 1000, dry_run: bool = False,
+                       workers: int = 10, max_concurrency: int = UPLOADS_CONCORRENTES_S3, dry_run: bool = False,
                        nome_consulta: str = "") -> dict:
     """
     Executa o fluxo completo para o S3:
       1. Valida a configuração e inicializa o cliente síncrono se necessário.
-      2. Executa a limpeza das partições recarregadas (deleção em batch).
-      3. Realiza o upload assíncrono dos arquivos.
+      2. Seleciona as chaves das partições recarregadas a partir de uma listagem única.
+      3. Executa a deleção em batch e o upload assíncrono concorrentemente.
     """
     s3_config = validar_config_s3(s3_config)
     s3_client_sync = s3_config["s3_client"]
     bucket = s3_config["bucket"]
 
-    # Identifica as partições locais a partir dos diretórios que contenham "idEmpresa="
-    particoes = [
-        os.path.relpath(root, temp_dir).replace(os.sep, "/")
-        for root, _, _ in os.walk(temp_dir) if "idEmpresa=" in root
-    ]
-    # Executa a limpeza das partições recarregadas (síncrona)
-    limpar_prefixo_no_s3(s3_client_sync, bucket, caminho_destino, particoes, workers, dry_run, nome_consulta)
+    # Uma única varredura de temp_dir fornece as partições (limpeza) e os arquivos (upload)
+    particoes, arquivos = listar_particoes_e_arquivos(temp_dir, caminho_destino)
+    object_keys = selecionar_chaves_para_exclusao(s3_client_sync, bucket, caminho_destino, particoes,
+                                                  workers, nome_consulta)
 
-    # Em seguida, realiza o upload assíncrono
-    return asyncio.run(realizar_upload_s3_async(temp_dir, caminho_destino, s3_config, max_concurrency, nome_consulta))
+    # Deleção e upload sobrepostos no loop compartilhado (reaproveita o cliente e suas conexões)
+    return executar_no_loop_s3(limpar_e_enviar_s3_async(temp_dir, caminho_destino, s3_config, object_keys,
+                                                        arquivos, workers, max_concurrency, dry_run,
+                                                        nome_consulta))
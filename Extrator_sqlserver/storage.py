@@ -1,12 +1,15 @@
-import asyncio
-import os
-
-from azure_storage import realizar_upload_azure
-from s3_storage import realizar_upload_s3
+from azure_storage import realizar_upload_azure, UPLOADS_CONCORRENTES_AZURE
+from s3_storage import realizar_upload_s3, UPLOADS_CONCORRENTES_S3
 import logging
+import os
 import concurrent.futures
 
-def enviar_resultados(temp_dir, portal, destino_tipo, destino_config, workers,nome_consulta):
+# Paralelismo padrão dos envios quando o chamador não informa `workers`: a mesma heurística
+# de I/O do pool ODBC (4 por CPU, até 32)
+WORKERS_ENVIO_PADRAO = min(32, 4 * (os.cpu_count() or 1))
+
+def enviar_resultados(temp_dir, portal, destino_tipo, destino_config, workers=None, nome_consulta="",
+                      envios_simultaneos=1):
     """
     Envia os resultados para os destinos configurados.
 
@@ -16,46 +19,37 @@ def enviar_resultados(temp_dir, portal, destino_tipo, destino_config, workers,no
         portal (str): Caminho base no destino.
         destino_tipo (str): Tipo de destino ("azure", "s3" ou "ambos").
         destino_config (dict): Configurações específicas do(s) destino(s).
-        workers (int): Número de threads para paralelismo.
+        workers (int, opcional): Número de threads para paralelismo (padrão: WORKERS_ENVIO_PADRAO).
+        envios_simultaneos (int, opcional): Quantos envios rodam ao mesmo tempo; o limite de uploads
+            em voo de cada destino é dividido entre eles.
 
     Returns:
         bool: `True` se o envio foi bem-sucedido para todos os destinos, `False` caso contrário.
     """
+    if workers is None:
+        workers = WORKERS_ENVIO_PADRAO
     caminho_destino = f"{portal}/{nome_consulta}"
+    # Fração deste envio no limite de uploads em voo de cada destino (o total continua no limite)
+    envios_simultaneos = max(1, envios_simultaneos)
+    uploads_azure = max(1, UPLOADS_CONCORRENTES_AZURE // envios_simultaneos)
+    uploads_s3 = max(1, UPLOADS_CONCORRENTES_S3 // envios_simultaneos)
     logging.info(f"Iniciando envio da consulta '{nome_consulta}' para '{destino_tipo}'.")
 
-    # Criar tarefas para upload em paralelo
-    futures = []
-    success_azure, success_s3 = None, None
-
-    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-        if destino_tipo in ["azure", "ambos"]:
-            futures.append(executor.submit(enviar_para_azure, workers, temp_dir, caminho_destino, destino_config.get("azure", {}), nome_consulta))
-        if destino_tipo in ["s3", "ambos"]:
-            futures.append(executor.submit(enviar_para_s3, workers, temp_dir, caminho_destino, destino_config.get("s3", {}), nome_consulta))
-
-        # Processar os resultados
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                resultado_envio = future.result()  # ✅ Agora captura corretamente o retorno
-                if destino_tipo in ["azure", "ambos"]:
-                    success_azure = resultado_envio
-                if destino_tipo in ["s3", "ambos"]:
-                    success_s3 = resultado_envio
-            except Exception as e:
-                logging.error(f"Erro ao enviar '{nome_consulta}' para '{destino_tipo}': {e}")
-                if destino_tipo in ["azure", "ambos"]:
-                    success_azure = False
-                if destino_tipo in ["s3", "ambos"]:
-                    success_s3 = False
-
-    # Avaliação final do sucesso do envio
     if destino_tipo == "azure":
-        sucesso = success_azure
+        sucesso = enviar_para_azure(workers, temp_dir, caminho_destino, destino_config.get("azure", {}), nome_consulta, uploads_azure)
     elif destino_tipo == "s3":
-        sucesso = success_s3
-    else:  # Ambos
-        sucesso = (success_azure is True) and (success_s3 is True)  # Somente retorna sucesso se ambos forem True
+        sucesso = enviar_para_s3(workers, temp_dir, caminho_destino, destino_config.get("s3", {}), nome_consulta, uploads_s3)
+    elif destino_tipo == "ambos":
+        # Executor por chamada: o Azure vai numa thread própria e o S3 na thread do chamador.
+        # Um pool compartilhado seria disputado pelos envios simultâneos do main e os
+        # serializaria (o paralelismo dos uploads, dimensionado por `workers`, fica dentro de cada envio)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="extrator-envio-azure") as executor:
+            future_azure = executor.submit(enviar_para_azure, workers, temp_dir, caminho_destino, destino_config.get("azure", {}), nome_consulta, uploads_azure)
+            sucesso_s3 = enviar_para_s3(workers, temp_dir, caminho_destino, destino_config.get("s3", {}), nome_consulta, uploads_s3)
+            # Somente retorna sucesso se ambos forem True
+            sucesso = (future_azure.result() is True) and (sucesso_s3 is True)
+    else:
+        sucesso = False
 
     if sucesso:
         logging.info(f"Todos os arquivos de '{caminho_destino}' foram enviados com sucesso.")
@@ -65,11 +59,13 @@ def enviar_resultados(temp_dir, portal, destino_tipo, destino_config, workers,no
     return sucesso
 
 
-def enviar_para_azure(workers, temp_dir, caminho_destino, azure_config, nome_consulta):
+def enviar_para_azure(workers, temp_dir, caminho_destino, azure_config, nome_consulta,
+                      max_concurrency=UPLOADS_CONCORRENTES_AZURE):
     """Executa o envio para o Azure."""
     try:
         # 🔹 Executa a função assíncrona e captura o retorno corretamente
-        resultado_upload = realizar_upload_azure(temp_dir, caminho_destino, azure_config, workers=workers, nome_consulta=nome_consulta)
+        resultado_upload = realizar_upload_azure(temp_dir, caminho_destino, azure_config, workers=workers,
+                                                 max_concurrency=max_concurrency, nome_consulta=nome_consulta)
 
         # 🔹 Verifica se houve erro no envio
         if resultado_upload["erros"]:
@@ -84,11 +80,13 @@ def enviar_para_azure(workers, temp_dir, caminho_destino, azure_config, nome_con
         return False  # Indica falha no envio
 
 
-def enviar_para_s3(workers, temp_dir, caminho_destino, s3_config, nome_consulta):
+def enviar_para_s3(workers, temp_dir, caminho_destino, s3_config, nome_consulta,
+                   max_concurrency=UPLOADS_CONCORRENTES_S3):
     """Executa o envio para o S3 e retorna o status."""
     try:
         # ✅ Captura corretamente o retorno de `realizar_upload_s3`
-        resultado_upload = realizar_upload_s3(temp_dir, caminho_destino, s3_config, workers=workers, nome_consulta=nome_consulta)
+        resultado_upload = realizar_upload_s3(temp_dir, caminho_destino, s3_config, workers=workers,
+                                              max_concurrency=max_concurrency, nome_consulta=nome_consulta)
 
         # ✅ Se houver erro no envio, retorna False
         if resultado_upload["erros"]: